@@ -0,0 +1,434 @@
+# ---------------------------------------------------------------------------------------------------------------------
+# Motor analítico em memória (NumPy/pandas): responde as questões do registro sem banco de dados
+# e serve de oráculo para conferir as respostas do SQL
+# Glenda Proença Train
+# ---------------------------------------------------------------------------------------------------------------------
+import re
+import time
+import decimal
+import argparse
+import datetime
+import numpy as np
+import pandas as pd
+from dataset import list_tables, read_table
+from queries import queries
+from runner import query_params, result_bytes, run_queries, print_query_report
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que lê as tabelas do dataset (já tipadas, pelo cache binário quando informado)
+def load_frames(dataset_dir="dataset", cache_dir=None):
+    return({table: read_table(table, csv_path, cache_dir) for table, csv_path in list_tables(dataset_dir).items()})
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que restringe as notas a um período (início inclusivo, fim exclusivo, como o date_range das consultas)
+# e os itens às notas que ficaram
+def restrict_frames(frames, date_range):
+    invoice = frames["invoice"]
+    keep = pd.Series(True, index=invoice.index)
+    if(date_range[0] is not None):
+        keep &= invoice["invoice_date"] >= pd.Timestamp(date_range[0])
+    if(date_range[1] is not None):
+        keep &= invoice["invoice_date"] < pd.Timestamp(date_range[1])
+    invoice_line = frames["invoice_line"]
+    return(dict(frames, invoice=invoice[keep],
+                invoice_line=invoice_line[invoice_line["invoice_id"].isin(invoice.loc[keep, "invoice_id"])]))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que monta um vetor denso indexado pelo id: vetor[id] = valor
+# As junções pela chave viram uma indexação do vetor (vetor[ids]), sem merge
+# (sem ids, por exemplo em um período sem notas, o vetor só tem a posição 0)
+def dense(ids, values, fill=None):
+    ids = np.asarray(ids)
+    values = np.asarray(values)
+    lookup = np.full(int(ids.max()) + 1 if len(ids) > 0 else 1, fill, dtype=object if fill is None else values.dtype)
+    lookup[ids] = values
+    return(lookup)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que converte uma coluna do dataframe em vetor do NumPy (categorias e NA viram objetos do python)
+def column(df, name):
+    series = df[name]
+    if(isinstance(series.dtype, pd.CategoricalDtype) or pd.api.types.is_extension_array_dtype(series)):
+        return(np.asarray(series.astype(object).where(series.notna(), None)))
+    return(series.to_numpy())
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que monta os vetores de junção das tabelas
+# Ex.: track_genre[track_id] = genre_id, track_artist[track_id] = artist_id (track -> album -> artist)
+def build_lookups(frames):
+    track = frames["track"]
+    album = frames["album"]
+    invoice = frames["invoice"]
+    customer = frames["customer"]
+
+    lookups = {
+        "genre_name": dense(column(frames["genre"], "genre_id"), column(frames["genre"], "genre_name")),
+        "artist_name": dense(column(frames["artist"], "artist_id"), column(frames["artist"], "artist_name")),
+        "track_name": dense(column(track, "track_id"), column(track, "track_name")),
+        "track_genre": dense(column(track, "track_id"), column(track, "genre_id"), 0),
+        "track_album": dense(column(track, "track_id"), column(track, "album_id"), 0),
+        "album_artist": dense(column(album, "album_id"), column(album, "artist_id"), 0),
+        "invoice_customer": dense(column(invoice, "invoice_id"), column(invoice, "customer_id"), 0),
+        "invoice_total": dense(column(invoice, "invoice_id"), column(invoice, "total"), 0.0),
+        "customer_country": dense(column(customer, "customer_id"), column(customer, "country")),
+        "customer_first_name": dense(column(customer, "customer_id"), column(customer, "first_name")),
+        "customer_last_name": dense(column(customer, "customer_id"), column(customer, "last_name")),
+        "customer_email": dense(column(customer, "customer_id"), column(customer, "email"))
+    }
+    lookups["track_artist"] = lookups["album_artist"][lookups["track_album"]]
+    return(lookups)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que agrupa as linhas por uma ou mais chaves (NULL forma um grupo, como no GROUP BY)
+# Retorna o código do grupo de cada linha e o valor das chaves em cada grupo
+def group_codes(*keys):
+    codes = np.zeros(len(keys[0]), dtype=np.int64)
+    for key in keys:
+        key_codes, uniques = pd.factorize(key, use_na_sentinel=False)
+        codes = codes * len(uniques) + key_codes
+    uniques, first, codes = np.unique(codes, return_index=True, return_inverse=True)
+    return(codes, [np.asarray(key)[first] for key in keys])
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que soma (ou conta, sem pesos) as linhas de cada grupo
+def group_sum(codes, weights=None, size=None):
+    return(np.bincount(codes, weights=weights, minlength=size or 0))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que ordena os grupos pelo valor (decrescente) e devolve os k primeiros (todos, sem k)
+# A ordenação é estável: nos empates fica a ordem dos grupos
+def top_k(values, k=None):
+    order = np.argsort(-np.asarray(values, dtype=float), kind="stable")
+    return(order if k is None else order[:k])
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que escolhe a linha de maior valor de cada partição (como ROW_NUMBER() ... WHERE row_num = 1)
+# Retorna os índices escolhidos, ordenados pela partição
+def top_per_partition(partition, values):
+    order = np.lexsort((-np.asarray(values, dtype=float), np.asarray(partition, dtype=object).astype(str)))
+    partitions = np.asarray(partition, dtype=object)[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = partitions[1:] != partitions[:-1]
+    return(order[first])
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que converte um valor do NumPy/pandas para o tipo do python (como o conector devolve)
+def python_value(value):
+    if(value is None or (isinstance(value, float) and np.isnan(value)) or value is pd.NaT or value is pd.NA):
+        return(None)
+    if(isinstance(value, (pd.Timestamp, np.datetime64))):
+        return(pd.Timestamp(value).to_pydatetime())
+    if(isinstance(value, np.generic)):
+        return(value.item())
+    return(value)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que monta as linhas da resposta a partir das colunas
+def rows(*columns):
+    return([tuple(python_value(value) for value in row) for row in zip(*columns)])
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que formata um valor em dólar como o CONCAT('$', ROUND(valor, casas)) do SQL
+def dollars(values, decimals=2):
+    if(decimals == 0):
+        return(["${}".format(int(round(float(value)))) for value in values])
+    return(["${}".format(round(float(value), decimals)) for value in values])
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Respostas de cada questão: recebem as tabelas, os vetores de junção e os parâmetros da consulta
+# e devolvem as linhas no mesmo formato do SQL do registro (resultado inteiro, sem o LIMIT do preview)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# 1) Gênero com mais faixas
+def popular_genre(frames, lookups, params):
+    codes, (names,) = group_codes(lookups["genre_name"][column(frames["track"], "genre_id")])
+    counts = group_sum(codes)
+    best = top_k(counts, 1)
+    return(rows(counts[best], names[best]))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# 2) Artista com mais itens vendidos
+def popular_artist(frames, lookups, params):
+    artists = lookups["track_artist"][column(frames["invoice_line"], "track_id")]
+    codes, (names,) = group_codes(lookups["artist_name"][artists])
+    counts = group_sum(codes)
+    best = top_k(counts, 1)
+    return(rows(counts[best], names[best]))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# 3) Música com mais itens vendidos
+def popular_track(frames, lookups, params):
+    codes, (names,) = group_codes(lookups["track_name"][column(frames["invoice_line"], "track_id")])
+    counts = group_sum(codes)
+    best = top_k(counts, 1)
+    return(rows(counts[best], names[best]))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# 4) Soma do total da fatura de cada item comprado, por gênero (a média de uma linha por gênero é a própria soma)
+def genre_average_price(frames, lookups, params):
+    invoice_line = frames["invoice_line"]
+    genres = lookups["track_genre"][column(invoice_line, "track_id")]
+    codes, (names,) = group_codes(lookups["genre_name"][genres])
+    totals = group_sum(codes, lookups["invoice_total"][column(invoice_line, "invoice_id")])
+    return(rows(names, dollars(totals, 0)))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# 5) Quantidade comprada por país do cliente
+# Usa a junção pretendida (invoice_line.invoice_id = invoice.invoice_id): o SQL do registro junta pelo
+# invoice_line_id e a conferência aponta a diferença
+def popular_country(frames, lookups, params):
+    invoice_line = frames["invoice_line"]
+    customers = lookups["invoice_customer"][column(invoice_line, "invoice_id")]
+    codes, (countries,) = group_codes(lookups["customer_country"][customers])
+    quantities = group_sum(codes, column(invoice_line, "quantity").astype(float))
+    best = top_k(quantities, 1)
+    return(rows(quantities[best].astype(np.int64), countries[best]))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# 6) Funcionário com a contratação mais antiga
+def oldest_employee(frames, lookups, params):
+    employee = frames["employee"]
+    first = np.argsort(column(employee, "hire_date"), kind="stable")[:1]
+    return(rows(column(employee, "first_name")[first], column(employee, "last_name")[first]))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# 7) Faturas por país
+def country_most_invoices(frames, lookups, params):
+    codes, (countries,) = group_codes(column(frames["invoice"], "billing_country"))
+    counts = group_sum(codes)
+    order = top_k(counts)
+    return(rows(counts[order], countries[order]))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# 8) Faturas de maior total
+def top_invoices(frames, lookups, params):
+    invoice = frames["invoice"]
+    order = top_k(column(invoice, "total"), params["limit"])
+    return(rows(*[column(invoice, name)[order] for name in invoice.columns]))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# 9) Cidade com o maior total de faturas
+def best_city(frames, lookups, params):
+    invoice = frames["invoice"]
+    codes, (cities,) = group_codes(column(invoice, "billing_city"))
+    totals = group_sum(codes, column(invoice, "total"))
+    best = top_k(totals, 1)
+    return(rows(cities[best], dollars(totals[best])))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# 10) Total das faturas de cada cliente
+def best_customer(frames, lookups, params):
+    invoice = frames["invoice"]
+    codes, (customers,) = group_codes(column(invoice, "customer_id"))
+    totals = group_sum(codes, column(invoice, "total"))
+    order = top_k(totals)
+    customers = customers[order]
+    return(rows(dollars(totals[order]), lookups["customer_first_name"][customers],
+                lookups["customer_last_name"][customers]))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# 11) Clientes que compraram alguma faixa do gênero, por e-mail
+def rock_listeners(frames, lookups, params):
+    invoice_line = frames["invoice_line"]
+    genres = lookups["genre_name"][lookups["track_genre"][column(invoice_line, "track_id")]]
+    customers = np.unique(lookups["invoice_customer"][column(invoice_line, "invoice_id")][genres == params["genre"]])
+    emails = lookups["customer_email"][customers]
+    order = np.argsort(emails.astype(str), kind="stable")
+    customers = customers[order]
+    return(rows(lookups["customer_first_name"][customers], lookups["customer_last_name"][customers],
+                emails[order], [params["genre"]] * len(customers)))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# 12) Artistas com mais faixas do gênero
+def top_rock_bands(frames, lookups, params):
+    track = frames["track"]
+    rock = lookups["genre_name"][column(track, "genre_id")] == params["genre"]
+    artists = lookups["track_artist"][column(track, "track_id")[rock]]
+    codes, (artist_ids,) = group_codes(artists)
+    counts = group_sum(codes)
+    order = top_k(counts, params["limit"])
+    return(rows(counts[order], lookups["artist_name"][artist_ids[order]]))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# 13) Faixas mais longas do que a média
+def long_tracks(frames, lookups, params):
+    track = frames["track"]
+    milliseconds = column(track, "milliseconds")
+    longer = np.flatnonzero(milliseconds > milliseconds.mean())
+    order = longer[top_k(milliseconds[longer])]
+    return(rows(column(track, "track_name")[order], milliseconds[order]))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# 14) Gasto de cada cliente com cada artista
+def customer_artist_spent(frames, lookups, params):
+    invoice_line = frames["invoice_line"]
+    customers = lookups["invoice_customer"][column(invoice_line, "invoice_id")]
+    artists = lookups["artist_name"][lookups["track_artist"][column(invoice_line, "track_id")]]
+    spent = column(invoice_line, "unit_price") * column(invoice_line, "quantity")
+    codes, (customer_ids, first_names, artist_names) = group_codes(customers,
+                                                                   lookups["customer_first_name"][customers],
+                                                                   artists)
+    totals = group_sum(codes, spent)
+    order = top_k(totals)
+    return(rows(customer_ids[order], first_names[order], artist_names[order], totals[order]))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# 15) Gênero com mais itens vendidos em cada país
+def country_popular_genre(frames, lookups, params):
+    invoice_line = frames["invoice_line"]
+    countries = lookups["customer_country"][lookups["invoice_customer"][column(invoice_line, "invoice_id")]]
+    genres = lookups["genre_name"][lookups["track_genre"][column(invoice_line, "track_id")]]
+    codes, (group_countries, group_genres) = group_codes(countries, genres)
+    counts = group_sum(codes)
+    best = top_per_partition(group_countries, counts)
+    return(rows(group_countries[best], group_genres[best], counts[best]))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# 16) Cliente (pelo primeiro nome) que mais gastou em cada país
+def country_best_customer(frames, lookups, params):
+    invoice = frames["invoice"]
+    first_names = lookups["customer_first_name"][column(invoice, "customer_id")]
+    codes, (group_names, group_countries) = group_codes(first_names, column(invoice, "billing_country"))
+    totals = group_sum(codes, column(invoice, "total"))
+    best = top_per_partition(group_countries, totals)
+    return(rows(group_names[best], group_countries[best], totals[best]))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Define a resposta em memória de cada consulta do registro
+# answer: função que calcula as linhas
+# score: colunas com os valores que ordenam/ranqueiam o resultado; se só elas batem com o SQL, a diferença
+# é um empate resolvido de outro jeito (ex.: LIMIT ou ROW_NUMBER entre linhas com o mesmo valor)
+answers = {
+    "popular_genre": {"answer": popular_genre, "score": [0]},
+
+    "popular_artist": {"answer": popular_artist, "score": [0]},
+
+    "popular_track": {"answer": popular_track, "score": [0]},
+
+    "genre_average_price": {"answer": genre_average_price, "score": [0, 1]},
+
+    "popular_country": {"answer": popular_country, "score": [0]},
+
+    "oldest_employee": {"answer": oldest_employee, "score": [0, 1]},
+
+    "country_most_invoices": {"answer": country_most_invoices, "score": [0]},
+
+    "top_invoices": {"answer": top_invoices, "score": [8]},
+
+    "best_city": {"answer": best_city, "score": [1]},
+
+    "best_customer": {"answer": best_customer, "score": [0]},
+
+    "rock_listeners": {"answer": rock_listeners, "score": [0, 1, 2, 3]},
+
+    "top_rock_bands": {"answer": top_rock_bands, "score": [0]},
+
+    "long_tracks": {"answer": long_tracks, "score": [1]},
+
+    "customer_artist_spent": {"answer": customer_artist_spent, "score": [3]},
+
+    "country_popular_genre": {"answer": country_popular_genre, "score": [0, 2]},
+
+    "country_best_customer": {"answer": country_best_customer, "score": [1, 2]}
+}
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que responde as consultas escolhidas (todas, se nenhuma for informada) em memória
+# Retorna os resultados no formato do runner.run_queries (linhas e medidas de cada consulta)
+def run_answers(frames, names=None, params=None):
+    start = time.perf_counter()
+    lookups = build_lookups(frames)
+    print("Analytics: vetores de junção montados em {:.2f} ms".format((time.perf_counter() - start) * 1000))
+
+    results = []
+    for name in [name for name in queries if names is None or name in names]:
+        start = time.perf_counter()
+        answer_rows = answers[name]["answer"](frames, lookups, query_params(queries[name], params))
+        results.append({"name": name,
+                        "rows": answer_rows,
+                        "latency": time.perf_counter() - start,
+                        "row_count": len(answer_rows),
+                        "bytes": result_bytes(answer_rows),
+                        "cached": False,
+                        "summary": False})
+    return(results)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que normaliza um valor para a comparação entre o SQL e o motor em memória
+# Números são arredondados em 2 casas, valores em dólar ("$1096" / "$1096.0") viram números
+# e datas viram texto (o SQLite devolve a data como texto)
+def normalize_value(value):
+    if(isinstance(value, str) and re.fullmatch(r"\$-?\d+(\.\d+)?", value) is not None):
+        return(("$", round(float(value[1:]), 2)))
+    if(isinstance(value, (int, float, decimal.Decimal)) and not isinstance(value, bool)):
+        return(round(float(value), 2))
+    if(isinstance(value, datetime.datetime)):
+        return(value.strftime("%Y-%m-%d %H:%M:%S"))
+    return(value)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que compara as linhas do SQL com as do motor em memória (sem depender da ordem das linhas)
+# Retorna "ok", "empate" (só os valores de ordenação batem) ou "diferente"
+def compare_rows(sql_rows, memory_rows, score):
+    def normalized(rows, columns=None):
+        return(sorted((tuple(normalize_value(value) for position, value in enumerate(row)
+                             if columns is None or position in columns) for row in rows), key=repr))
+
+    if(normalized(sql_rows) == normalized(memory_rows)):
+        return("ok")
+    if(normalized(sql_rows, score) == normalized(memory_rows, score)):
+        return("empate")
+    return("diferente")
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que confere as respostas do SQL com as do motor em memória e imprime o relatório
+# As consultas rodam com o resultado inteiro (buffered), para comparar todas as linhas
+# Retorna as consultas com resposta diferente
+def cross_check(pool, frames, names=None, workers=4, summaries=True, date_range=None):
+    if(date_range is not None):
+        frames = restrict_frames(frames, date_range)
+    sql_results = {result["name"]: result for result in run_queries(pool, names, workers, fetch="buffered",
+                                                                    summaries=summaries, date_range=date_range)}
+    memory_results = {result["name"]: result for result in run_answers(frames, names)}
+
+    different = []
+    print("\nConferência SQL x memória:")
+    print("   {:<24} {:>10} {:>10}  {}".format("Consulta", "SQL", "Memória", "Resultado"))
+    for name, sql_result in sql_results.items():
+        memory_result = memory_results[name]
+        status = compare_rows(sql_result["rows"], memory_result["rows"], answers[name]["score"])
+        print("   {:<24} {:>10} {:>10}  {}".format(name, sql_result["row_count"], memory_result["row_count"], status))
+        if(status == "diferente"):
+            different.append(name)
+            for label, result in [("SQL", sql_result), ("Memória", memory_result)]:
+                print("   {:<24} {}: {}".format("", label, result["rows"][:3]))
+    return(different)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que imprime as respostas do motor em memória, no formato das questões
+def solve_in_memory(frames, names=None):
+    start = time.perf_counter()
+    results = run_answers(frames, names)
+    wall = time.perf_counter() - start
+
+    for result in results:
+        query = queries[result["name"]]
+        print("\n" + query["title"])
+        for line in query["format"](result["rows"]):
+            print(line)
+
+    print_query_report(results, wall)
+    return(results)
+# ---------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    # Relatório das questões direto dos csv, sem banco de dados
+    parser = argparse.ArgumentParser(description="Responde as questões em memória (NumPy/pandas), sem banco")
+    parser.add_argument("--questions", nargs="+", choices=list(queries), metavar="QUESTION",
+                        help="consultas do registro a responder (padrão: todas)")
+    parser.add_argument("--dataset-cache", default=None, help="pasta do cache binário (Arrow) dos csv já tipados")
+    args = parser.parse_args()
+
+    solve_in_memory(load_frames("dataset", args.dataset_cache), args.questions)
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,224 @@
+# ---------------------------------------------------------------------------------------------------------------------
+# Bancos embarcados (SQLite e DuckDB): a carga e as consultas rodam no próprio processo, sem o servidor MySQL
+# Glenda Proença Train
+# ---------------------------------------------------------------------------------------------------------------------
+import os
+import re
+import sqlite3
+import pandas as pd
+
+# O DuckDB é opcional (pip install duckdb), só é necessário com --backend duckdb
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Erros dos bancos embarcados, tratados como os do conector MySQL (ex.: na troca de estratégia da carga)
+embedded_errors = (sqlite3.Error,) + ((duckdb.Error,) if duckdb is not None else ())
+# ---------------------------------------------------------------------------------------------------------------------
+
+# O SQLite não converte as datas do pandas: são gravadas como texto ISO, que ordena igual à data
+sqlite3.register_adapter(pd.Timestamp, lambda value: value.isoformat(sep=" "))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Define o dialeto de cada banco embarcado
+# param: prefixo dos parâmetros nomeados (o SQL do projeto usa %(nome)s e %s, no formato do conector MySQL)
+# rewrites: [padrão, substituição] aplicados ao SQL; um comando que fica vazio é ignorado
+# concat: reescreve CONCAT(a, b) como (a || b) (o SQLite só tem CONCAT a partir da versão 3.44)
+# writers: cargas em paralelo permitidas (o SQLite aceita um único escritor por vez)
+# indexes: cria os índices secundários depois da carga
+rewrites = [[r"\s*ENGINE=InnoDB( DEFAULT CHARSET=utf8mb4)?", ""]]
+
+dialects = {
+    "sqlite": {
+        "extension": "sqlite",
+        "param": ":",
+        "rewrites": rewrites + [[r"^\s*SET foreign_key_checks = (\d)\s*$", r"PRAGMA foreign_keys = \1"]],
+        "concat": True,
+        "writers": 1,
+        "indexes": True
+    },
+
+    # O DuckDB verifica as chaves estrangeiras linha a linha e não permite desligar a verificação
+    # (nem o auto-relacionamento de employee carregaria): as chaves não são declaradas e as relações
+    # são validadas depois da carga, pelas linhas órfãs
+    # Os índices (ART) só ajudam em buscas pontuais, as consultas das questões leem as colunas inteiras
+    "duckdb": {
+        "extension": "duckdb",
+        "param": "$",
+        "rewrites": rewrites + [[r"^\s*SET foreign_key_checks = \d\s*$", ""],
+                                [r",\s*FOREIGN KEY \(\w+\) REFERENCES \w+\(\w+\)", ""]],
+        "concat": False,
+        "writers": None,
+        "indexes": False
+    }
+}
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que separa os argumentos de uma função SQL, respeitando parênteses e textos entre aspas
+# Retorna os argumentos e a posição do parêntese que fecha a chamada
+def split_arguments(sql, start):
+    arguments = []
+    depth = 0
+    quote = None
+    current = start
+    for position in range(start, len(sql)):
+        char = sql[position]
+        if(quote is not None):
+            if(char == quote):
+                quote = None
+        elif(char in "'\""):
+            quote = char
+        elif(char == "("):
+            depth += 1
+        elif(char == ")" and depth > 0):
+            depth -= 1
+        elif(char == ")" or (char == "," and depth == 0)):
+            arguments.append(sql[current:position].strip())
+            current = position + 1
+            if(char == ")"):
+                return(arguments, position)
+    raise ValueError("Parêntese sem fechamento no SQL: {}".format(sql[start:]))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que reescreve CONCAT(a, b, ...) como (a || b || ...), inclusive chamadas aninhadas
+def rewrite_concat(sql):
+    match = re.search(r"\bCONCAT\s*\(", sql, re.IGNORECASE)
+    while(match is not None):
+        arguments, end = split_arguments(sql, match.end())
+        sql = sql[:match.start()] + "(" + " || ".join(rewrite_concat(argument) for argument in arguments) + ")" \
+            + sql[end + 1:]
+        match = re.search(r"\bCONCAT\s*\(", sql, re.IGNORECASE)
+    return(sql)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que traduz um comando do formato do MySQL para o dialeto do banco embarcado
+def translate(sql, backend):
+    dialect = dialects[backend]
+    for pattern, replacement in dialect["rewrites"]:
+        sql = re.sub(pattern, replacement, sql, flags=re.IGNORECASE)
+    if(dialect["concat"]):
+        sql = rewrite_concat(sql)
+    sql = re.sub(r"%\((\w+)\)s", lambda match: dialect["param"] + match.group(1), sql)
+    return(sql.replace("%s", "?"))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Cursor do banco embarcado com a mesma interface usada do cursor do conector MySQL
+# (context manager, parâmetros %s / %(nome)s, fetchone, fetchmany e fetchall)
+class EmbeddedCursor:
+
+    def __init__(self, backend, cursor):
+        self.backend = backend
+        self.cursor = cursor
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def execute(self, sql, params=None):
+        sql = translate(sql, self.backend)
+        if(sql.strip() != ""):
+            self.cursor.execute(sql, params if params is not None else ())
+
+    def executemany(self, sql, records):
+        self.cursor.executemany(translate(sql, self.backend), records)
+
+    def fetchone(self):
+        return(self.cursor.fetchone())
+
+    def fetchmany(self, size=1):
+        return(self.cursor.fetchmany(size))
+
+    def fetchall(self):
+        return(self.cursor.fetchall())
+
+    @property
+    def rowcount(self):
+        return(self.cursor.rowcount)
+
+    def close(self):
+        # O cursor do DuckDB é a própria conexão do pool, fechada junto com ela
+        if(self.backend == "sqlite"):
+            self.cursor.close()
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Conexão do banco embarcado com a mesma interface usada da conexão do conector MySQL
+# Os resultados são sempre lidos do próprio processo, então não sobra resultado pendente na conexão
+class EmbeddedConnection:
+
+    unread_result = False
+
+    def __init__(self, backend, connection):
+        self.backend = backend
+        self.connection = connection
+
+    def cursor(self, buffered=False):
+        if(self.backend == "sqlite"):
+            return(EmbeddedCursor(self.backend, self.connection.cursor()))
+        return(EmbeddedCursor(self.backend, self.connection))
+
+    def consume_results(self):
+        pass
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        # No DuckDB cada comando fora de transação já é confirmado, não há o que desfazer
+        if(self.backend == "sqlite"):
+            self.connection.rollback()
+
+    def close(self):
+        self.connection.close()
+
+    # Registra um dataframe como tabela virtual (DuckDB), lida sem converter linha a linha
+    def register(self, name, df):
+        self.connection.register(name, df)
+
+    def unregister(self, name):
+        self.connection.unregister(name)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Pool de conexões do banco embarcado, com o get_connection do pool do conector MySQL
+# SQLite: cada conexão abre o arquivo (várias leituras em paralelo); o banco em memória é compartilhado entre
+# as conexões e fica aberto enquanto o pool existir
+# DuckDB: cada conexão é um cursor da mesma base (um cursor por thread)
+class EmbeddedPool:
+
+    def __init__(self, backend, path):
+        self.backend = backend
+        self.path = path
+        self.uri = False
+        if(backend == "sqlite" and path == ":memory:"):
+            self.path = "file:sqlproject?mode=memory&cache=shared"
+            self.uri = True
+        if(backend == "duckdb"):
+            self.database = duckdb.connect(path)
+        elif(self.uri):
+            self.database = sqlite3.connect(self.path, uri=True)
+
+    def get_connection(self):
+        if(self.backend == "duckdb"):
+            return(EmbeddedConnection(self.backend, self.database.cursor()))
+        return(EmbeddedConnection(self.backend, sqlite3.connect(self.path, uri=self.uri, check_same_thread=False)))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que cria o banco embarcado do zero (o arquivo anterior é apagado)
+# O arquivo padrão é sqlproject.<backend> na pasta atual; ":memory:" mantém o banco só em memória
+# Retorna uma conexão e o pool, como a conexão principal e o pool retornados pelo connect_db do MySQL
+def connect_embedded(backend, path=None):
+    if(backend == "duckdb" and duckdb is None):
+        raise ImportError("O backend duckdb precisa do pacote duckdb (pip install duckdb)")
+
+    path = path or "sqlproject.{}".format(dialects[backend]["extension"])
+    if(path != ":memory:"):
+        for name in [path, path + "-journal", path + ".wal"]:
+            if(os.path.exists(name)):
+                os.remove(name)
+
+    pool = EmbeddedPool(backend, path)
+    return(pool.get_connection(), pool)
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,85 @@
+# ---------------------------------------------------------------------------------------------------------------------
+# Benchmark da carga e das consultas em várias escalas do dataset (ver generate.py)
+# Glenda Proença Train
+# ---------------------------------------------------------------------------------------------------------------------
+import os
+import sys
+import json
+import platform
+import argparse
+from datetime import datetime
+from generate import ensure_dataset
+from insert_data import main
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que executa a carga e as 16 questões em uma escala e resume as medições
+# Retorna {escala, linhas, tempo de geração, tempo de cada etapa e tipo de span, carga de cada tabela,
+# latência de cada consulta}
+def bench_scale(scale, backend, data_dir, workers=4, seed=0, skew=1.0, extra=()):
+    directory = os.path.join(data_dir, "sf{}".format(scale))
+    dataset = ensure_dataset(scale, directory, seed=seed, skew=skew)
+
+    argv = ["--backend", backend, "--dataset", directory, "--workers", str(workers), "--fetch", "stream"]
+    argv += list(extra)
+    if(backend != "mysql"):
+        argv += ["--database-file", os.path.join(directory, "sqlproject.{}".format(backend))]
+    report = main(argv)
+
+    return({"scale": scale,
+            "rows": dataset["rows"],
+            "generate_seconds": dataset["seconds"],
+            "phases": report["phases"],
+            "totals": report["metrics"]["totals"],
+            "load": [{key: stat[key] for key in ["table", "strategy", "rows", "seconds", "rows_per_sec"] if key in stat}
+                     for stat in report["load"]],
+            "queries": [{key: result[key] for key in ["name", "latency", "row_count", "bytes", "cached", "summary"]}
+                        for result in report["queries"]]})
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que mostra o resumo do benchmark: tempo das etapas e das consultas em cada escala
+def print_bench_report(results):
+    scales = [result["scale"] for result in results]
+    print("\nBenchmark (segundos por escala):")
+    print("   {:<28}".format("Etapa / consulta") + "".join("{:>12}".format("{}x".format(scale)) for scale in scales))
+    phases = [phase for phase in results[0]["phases"]]
+    for phase in phases:
+        print("   {:<28}".format(phase) + "".join("{:>12.3f}".format(result["phases"].get(phase, 0))
+                                                 for result in results))
+    for position, query in enumerate(results[0]["queries"]):
+        print("   {:<28}".format(query["name"]) + "".join("{:>12.3f}".format(result["queries"][position]["latency"])
+                                                         for result in results))
+# ---------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mede a carga e as consultas em várias escalas do dataset")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 100], help="fatores de escala (ex.: 1 100 10000)")
+    parser.add_argument("--backend", default="mysql", choices=["mysql", "sqlite", "duckdb"], help="banco medido")
+    parser.add_argument("--workers", type=int, default=4, help="tabelas carregadas em paralelo")
+    parser.add_argument("--data-dir", default="benchmark", help="pasta dos datasets gerados (um por escala)")
+    parser.add_argument("--output", default=None, help="arquivo json dos resultados (padrão: <data-dir>/results.json)")
+    parser.add_argument("--seed", type=int, default=0, help="semente do gerador")
+    parser.add_argument("--skew", type=float, default=1.0, help="expoente de Zipf do gerador")
+    parser.add_argument("--no-summaries", action="store_true", help="mede as consultas sem as tabelas de resumo")
+    args = parser.parse_args()
+
+    results = []
+    for scale in args.scales:
+        print("\n===== Escala {}x ({}) =====".format(scale, args.backend))
+        results.append(bench_scale(scale, args.backend, args.data_dir, args.workers, args.seed, args.skew,
+                                   ["--no-summaries"] if args.no_summaries else []))
+    print_bench_report(results)
+
+    # Grava os resultados com a descrição da execução, para comparar com execuções anteriores
+    output = args.output or os.path.join(args.data_dir, "results.json")
+    with open(output, "w") as f:
+        json.dump({"started_at": datetime.now().isoformat(timespec="seconds"),
+                   "backend": args.backend,
+                   "workers": args.workers,
+                   "seed": args.seed,
+                   "skew": args.skew,
+                   "summaries": not args.no_summaries,
+                   "python": sys.version.split()[0],
+                   "platform": platform.platform(),
+                   "results": results}, f, indent=2)
+    print("Benchmark: resultados gravados em {}".format(output))
+# ---------------------------------------------------------------------------------------------------------------------
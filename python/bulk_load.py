@@ -0,0 +1,277 @@
+# ---------------------------------------------------------------------------------------------------------------------
+# Carga em massa das tabelas a partir dos csv
+# Glenda Proença Train
+# ---------------------------------------------------------------------------------------------------------------------
+import os
+import time
+import tempfile
+import mysql.connector as mysql
+from dataset import date_columns, read_header, base_table
+from backends import embedded_errors
+from metrics import execute_ddl
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Tokens de data do python que mudam no STR_TO_DATE do MySQL
+mysql_date_tokens = {"%M": "%i", "%S": "%s"}
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que verifica se o servidor permite o LOAD DATA LOCAL INFILE
+def local_infile_enabled(connection):
+    with connection.cursor(buffered=True) as cursor:
+        cursor.execute("SHOW GLOBAL VARIABLES LIKE 'local_infile'")
+        row = cursor.fetchone()
+    return(row is not None and str(row[1]).upper() in ("ON", "1"))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que converte um pedaço do dataframe em tuplas aceitas pelo conector (NaN e NA viram NULL)
+# O astype(object) também devolve os inteiros reduzidos e as categorias do dataset.py como valores do python
+def dataframe_records(df):
+    df = df.astype(object).where(df.notna(), None)
+    return(list(df.itertuples(index=False, name=None)))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que detecta o fim de linha do csv ('\r\n' nos csv do dataset, '\n' nos gravados pelo pandas)
+def line_terminator(csv_path):
+    with open(csv_path, "rb") as f:
+        line = f.readline()
+    return("\r\n" if line.endswith(b"\r\n") else "\n")
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Estratégia 1: o servidor lê o csv direto do disco do cliente (LOAD DATA LOCAL INFILE)
+# Não precisa do dataframe, as conversões de data e NULL são feitas pelo próprio MySQL
+# Se o dataframe tiver colunas que não estão no csv (ex.: invoice_line.invoice_date, copiada da nota para o
+# particionamento), ele é gravado em um csv temporário (as datas do csv no formato original, as demais no do MySQL)
+# Com LOCAL, o MySQL trata erros de conversão como avisos (IGNORE) e grava a linha assim mesmo: qualquer aviso
+# desfaz a carga e é tratado como falha, para a próxima estratégia ser tentada
+def load_infile(connection, engine, table, csv_path, df, chunk_size):
+    columns = read_header(csv_path)
+    dates = date_columns.get(base_table(table), {})
+    if(len(set(df.columns) - set(columns)) > 0):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False, encoding="utf-8", newline="") as f:
+            df.assign(**{column: df[column].dt.strftime(date_format) for column, date_format in dates.items()}) \
+              .to_csv(f, index=False, date_format="%Y-%m-%d %H:%M:%S", lineterminator="\n")
+        try:
+            return(load_infile(connection, engine, table, f.name, df[[]], chunk_size))
+        finally:
+            os.remove(f.name)
+
+    # Cada coluna é lida em uma variável e convertida no SET (campo vazio vira NULL)
+    assignments = []
+    for column in columns:
+        if(column in dates):
+            date_format = dates[column]
+            for token, mysql_token in mysql_date_tokens.items():
+                date_format = date_format.replace(token, mysql_token)
+            assignments.append("{0} = STR_TO_DATE(NULLIF(@{0}, ''), '{1}')".format(column, date_format))
+        else:
+            assignments.append("{0} = NULLIF(@{0}, '')".format(column))
+
+    # O nome do arquivo precisa ser um literal no LOAD DATA
+    path = os.path.abspath(csv_path).replace("\\", "\\\\").replace("'", "\\'")
+    terminator = line_terminator(csv_path).replace("\r", "\\r").replace("\n", "\\n")
+    sql_load = "LOAD DATA LOCAL INFILE '{}' INTO TABLE {} CHARACTER SET utf8mb4 \
+                FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' \
+                LINES TERMINATED BY '{}' IGNORE 1 LINES \
+                ({}) SET {}".format(path, table, terminator,
+                                    ", ".join("@" + column for column in columns),
+                                    ", ".join(assignments))
+
+    with connection.cursor(buffered=True) as cursor:
+        cursor.execute(sql_load)
+        rows = cursor.rowcount
+        cursor.execute("SELECT @@warning_count")
+        count = cursor.fetchone()[0]
+        if(count > 0):
+            cursor.execute("SHOW WARNINGS LIMIT 3")
+            raise mysql.DataError("LOAD DATA gerou {} avisos (ex.: {})".format(
+                count, "; ".join(str(warning[2]) for warning in cursor.fetchall())))
+    connection.commit()
+    return(rows)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Estratégia 2: INSERT com várias linhas por comando (o executemany do conector agrupa o lote)
+def load_executemany(connection, engine, table, csv_path, df, chunk_size):
+    sql_insert = "INSERT INTO {} ({}) VALUES ({})".format(table,
+                                                         ", ".join(df.columns),
+                                                         ", ".join(["%s"] * len(df.columns)))
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(df), chunk_size):
+            cursor.executemany(sql_insert, dataframe_records(df.iloc[start:start + chunk_size]))
+    connection.commit()
+    return(len(df))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Estratégia 3: fallback pelo próprio pandas (INSERT multi-linhas via SQLAlchemy)
+# A engine usa outra sessão, então as chaves estrangeiras também são desligadas nela durante a carga
+def load_pandas(connection, engine, table, csv_path, df, chunk_size):
+    with engine.begin() as engine_connection:
+        engine_connection.exec_driver_sql("SET foreign_key_checks = 0")
+        df.to_sql(table, con=engine_connection, if_exists='append', index=False, method="multi", chunksize=chunk_size)
+        engine_connection.exec_driver_sql("SET foreign_key_checks = 1")
+    return(len(df))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Estratégia 4 (DuckDB): o banco lê o dataframe direto da memória, sem converter linha a linha
+def load_dataframe(connection, engine, table, csv_path, df, chunk_size):
+    name = "incoming_" + table
+    connection.register(name, df)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO {0} ({1}) SELECT {1} FROM {2}".format(table, ", ".join(df.columns), name))
+    finally:
+        connection.unregister(name)
+    return(len(df))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Estratégias disponíveis (a ordem usada em cada banco fica em backend_strategies)
+strategies = {
+    "infile": load_infile,
+
+    "executemany": load_executemany,
+
+    "pandas": load_pandas,
+
+    "dataframe": load_dataframe
+}
+
+# Estratégias de cada banco, da mais rápida para a mais lenta
+backend_strategies = {
+    "mysql": ["infile", "executemany", "pandas"],
+
+    "sqlite": ["executemany"],
+
+    "duckdb": ["dataframe", "executemany"]
+}
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que define a ordem das estratégias a serem tentadas
+# No modo "auto", usa a mais rápida que o banco permite e deixa as outras como alternativa
+def choose_strategies(connection, strategy="auto", backend="mysql"):
+    if(strategy != "auto"):
+        return([strategy])
+
+    order = list(backend_strategies[backend])
+    if(backend == "mysql" and not local_infile_enabled(connection)):
+        order.remove("infile")
+    return(order)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que carrega uma tabela (já criada) tentando as estratégias em ordem
+# Antes da próxima estratégia, a tabela é esvaziada: o rollback não desfaz a carga parcial no DuckDB
+# (cada comando já é confirmado) e a nova tentativa duplicaria as linhas
+# Retorna as estatísticas da carga (estratégia usada, linhas, tempo e linhas/s)
+def load_table(connection, engine, table, csv_path, df, order, chunk_size=5000):
+    for position, strategy in enumerate(order):
+        start = time.perf_counter()
+        try:
+            rows = strategies[strategy](connection, engine, table, csv_path, df, chunk_size)
+        except (mysql.Error,) + embedded_errors as error:
+            connection.rollback()
+
+            # Se não houver outra estratégia, repassa o erro
+            if(position == len(order) - 1):
+                raise
+            with connection.cursor() as cursor:
+                cursor.execute("DELETE FROM {}".format(table))
+            connection.commit()
+            print("Aviso: estratégia {} falhou na tabela {} ({}), tentando a próxima".format(strategy, table, error))
+            continue
+
+        return(load_stats(table, strategy, rows, time.perf_counter() - start))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que grava as chaves do csv (e a coluna da partição) em uma tabela temporária <tabela>__keys
+def load_keys(cursor, table, df, columns, chunk_size=5000):
+    definitions = ["{} INT NOT NULL".format(columns[0])] + ["{} DATETIME NULL".format(column) for column in columns[1:]]
+    execute_ddl(cursor, "CREATE TEMPORARY TABLE {}__keys ({}, PRIMARY KEY ({}))".format(
+        table, ", ".join(definitions), columns[0]))
+    for position in range(0, len(df), chunk_size):
+        cursor.executemany("INSERT INTO {}__keys ({}) VALUES ({})".format(table, ", ".join(columns),
+                                                                         ", ".join(["%s"] * len(columns))),
+                           dataframe_records(df[columns].iloc[position:position + chunk_size]))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que aplica um csv alterado sobre uma tabela já carregada (carga incremental)
+# As linhas são inseridas ou atualizadas pela chave primária (INSERT ... ON DUPLICATE KEY UPDATE)
+# e as linhas que saíram do csv são removidas
+# Nas tabelas particionadas (partition_column), a chave primária é (id, data): a linha cuja data mudou é
+# removida antes do upsert e inserida de novo, na partição da nova data (senão a chave ficaria repetida)
+# As estatísticas contam as linhas antigas alteradas ou removidas ("changed_rows"), para quem depende
+# da tabela saber se ela só recebeu linhas novas
+def upsert_table(connection, table, df, key, chunk_size=5000, partition_column=None):
+    start = time.perf_counter()
+    columns = list(df.columns)
+    sql_insert = "INSERT INTO {} ({}) VALUES ({})".format(table, ", ".join(columns), ", ".join(["%s"] * len(columns)))
+
+    with connection.cursor(buffered=True) as cursor:
+        changed = 0
+        affected = 0
+        keys = False
+
+        if(key is None):
+            # Sem chave primária não dá para identificar a linha alterada: substitui o conteúdo da tabela
+            cursor.execute("SELECT COUNT(*) FROM {}".format(table))
+            changed = cursor.fetchone()[0]
+            cursor.execute("DELETE FROM {}".format(table))
+        else:
+            if(partition_column is not None):
+                load_keys(cursor, table, df, [key, partition_column], chunk_size)
+                keys = True
+                cursor.execute("DELETE {0} FROM {0} \
+                                INNER JOIN {0}__keys AS csv_keys ON csv_keys.{1} = {0}.{1} \
+                                WHERE NOT csv_keys.{2} <=> {0}.{2}".format(table, key, partition_column))
+                changed += cursor.rowcount
+
+            updates = ", ".join("{0} = VALUES({0})".format(column) for column in columns if column != key)
+            if(updates == ""):
+                updates = "{0} = {0}".format(key)
+            sql_insert += " ON DUPLICATE KEY UPDATE {}".format(updates)
+
+        cursor.execute("SELECT COUNT(*) FROM {}".format(table))
+        before = cursor.fetchone()[0]
+        for position in range(0, len(df), chunk_size):
+            cursor.executemany(sql_insert, dataframe_records(df.iloc[position:position + chunk_size]))
+            affected += max(cursor.rowcount, 0)
+
+        # Se sobraram mais linhas do que o csv tem, remove as que não estão mais no csv
+        if(key is not None):
+            cursor.execute("SELECT COUNT(*) FROM {}".format(table))
+            after = cursor.fetchone()[0]
+
+            # No upsert, cada linha nova conta 1 linha afetada e cada linha alterada conta 2
+            changed += (affected - (after - before)) // 2
+            if(after > len(df)):
+                if(not keys):
+                    load_keys(cursor, table, df, [key], chunk_size)
+                    keys = True
+                cursor.execute("DELETE {0} FROM {0} \
+                                LEFT JOIN {0}__keys AS csv_keys ON csv_keys.{1} = {0}.{1} \
+                                WHERE csv_keys.{1} IS NULL".format(table, key))
+                changed += cursor.rowcount
+        if(keys):
+            execute_ddl(cursor, "DROP TEMPORARY TABLE {}__keys".format(table))
+    connection.commit()
+
+    stats = load_stats(table, "upsert", len(df), time.perf_counter() - start)
+    stats["changed_rows"] = changed
+    return(stats)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que monta as estatísticas da carga de uma tabela
+def load_stats(table, strategy, rows, seconds):
+    return({"table": table,
+            "strategy": strategy,
+            "rows": rows,
+            "seconds": seconds,
+            "rows_per_sec": rows / seconds if seconds > 0 else 0})
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que imprime o relatório de carga de cada tabela
+def print_load_report(stats):
+    print("\nCarga das tabelas:")
+    print("   {:<16} {:<12} {:>10} {:>10} {:>14}".format("Tabela", "Estratégia", "Linhas", "Tempo(s)", "Linhas/s"))
+    for stat in stats:
+        print("   {:<16} {:<12} {:>10} {:>10.3f} {:>14.0f}".format(stat["table"], stat["strategy"], stat["rows"],
+                                                                 stat["seconds"], stat["rows_per_sec"]))
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,140 @@
+# ---------------------------------------------------------------------------------------------------------------------
+# Cache dos resultados das consultas, versionado pelo conteúdo das tabelas lidas
+# Glenda Proença Train
+# ---------------------------------------------------------------------------------------------------------------------
+import os
+import re
+import json
+import pickle
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que monta a chave do cache: SQL normalizado, parâmetros e versão de cada tabela lida
+# Quando uma tabela é recarregada com outro conteúdo, a versão muda e a chave antiga deixa de ser usada
+def cache_key(sql, params, versions):
+    normalized = re.sub(r"\s+", " ", sql).strip().lower()
+    content = json.dumps([normalized, params, sorted(versions.items())], sort_keys=True, default=str)
+    return(hashlib.sha256(content.encode("utf-8")).hexdigest())
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Cache em dois níveis: memória (LRU limitado pelo número de entradas) e, opcionalmente, disco
+# (limitado pelo total de bytes, descartando as entradas lidas há mais tempo)
+# As consultas rodam em paralelo: um arquivo do disco pode ser descartado por outra thread a qualquer momento,
+# então uma entrada que some ou não pode ser lida conta como ausente
+class ResultCache:
+
+    def __init__(self, max_entries=128, directory=None, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        if(directory is not None):
+            os.makedirs(directory, exist_ok=True)
+
+    # Caminho do arquivo de uma entrada no disco
+    def path(self, key):
+        return(os.path.join(self.directory, key + ".pkl"))
+
+    # Busca uma entrada (memória primeiro, depois disco). Retorna None se não existir
+    def get(self, key):
+        with self.lock:
+            if(key in self.memory):
+                self.memory.move_to_end(key)
+                return(self.memory[key][1])
+
+        if(self.directory is None):
+            return(None)
+        try:
+            with open(self.path(key), "rb") as f:
+                tables = pickle.load(f)
+                value = pickle.load(f)
+
+            # Marca o acesso (usado na ordem de descarte do disco)
+            os.utime(self.path(key))
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return(None)
+
+        # Sobe a entrada para a memória
+        self.put_memory(key, tables, value)
+        return(value)
+
+    # Guarda uma entrada em memória, descartando a usada há mais tempo se passar do limite
+    # (as consultas rodam em paralelo, então a memória é protegida por um lock)
+    def put_memory(self, key, tables, value):
+        with self.lock:
+            self.memory[key] = (tables, value)
+            self.memory.move_to_end(key)
+            while(len(self.memory) > self.max_entries):
+                self.memory.popitem(last=False)
+
+    # Guarda uma entrada (as tabelas lidas ficam junto, para a invalidação)
+    def put(self, key, tables, value):
+        self.put_memory(key, tables, value)
+        if(self.directory is None):
+            return
+
+        # As tabelas são gravadas antes do resultado, para a invalidação não precisar ler o resultado
+        # O arquivo é gravado em um temporário e trocado de uma vez, para um leitor nunca ver a entrada pela metade
+        with tempfile.NamedTemporaryFile("wb", dir=self.directory, suffix=".tmp", delete=False) as f:
+            pickle.dump(sorted(tables), f)
+            pickle.dump(value, f)
+        os.replace(f.name, self.path(key))
+        self.evict()
+
+    # Descarta as entradas do disco lidas há mais tempo até caber no limite de bytes
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if(name.endswith(".pkl")):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(entry[1] for entry in entries)
+        for mtime, size, name in sorted(entries):
+            if(total <= self.max_bytes):
+                break
+            remove_entry(os.path.join(self.directory, name))
+            total -= size
+
+    # Remove as entradas que leem alguma das tabelas informadas (ex.: tabelas recarregadas)
+    def invalidate(self, tables):
+        tables = set(tables)
+        removed = set()
+        with self.lock:
+            for key in [key for key, entry in self.memory.items() if len(tables & set(entry[0])) > 0]:
+                del self.memory[key]
+                removed.add(key)
+
+        if(self.directory is not None):
+            for name in os.listdir(self.directory):
+                if(not name.endswith(".pkl")):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    with open(path, "rb") as f:
+                        entry_tables = pickle.load(f)
+                except FileNotFoundError:
+                    continue
+                except (OSError, EOFError, pickle.UnpicklingError):
+                    # Entrada ilegível: é removida junto com as invalidadas
+                    entry_tables = tables
+                if(len(tables & set(entry_tables)) > 0):
+                    remove_entry(path)
+                    removed.add(name[:-4])
+        return(len(removed))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que remove um arquivo do cache, caso outra thread ainda não o tenha removido
+def remove_entry(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,139 @@
+# ---------------------------------------------------------------------------------------------------------------------
+# Leitura dos arquivos csv do dataset
+# Glenda Proença Train
+# ---------------------------------------------------------------------------------------------------------------------
+import os
+import numpy as np
+import pandas as pd
+from manifest import file_hash
+
+# O pyarrow é opcional: sem ele, os csv são sempre lidos do texto
+try:
+    import pyarrow
+    import pyarrow.feather as feather
+except ImportError:
+    pyarrow = None
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Define as colunas de data de cada tabela e o formato em que estão salvas no csv
+# (informar o formato evita que o pandas tenha que adivinhar linha a linha)
+date_columns = {
+    "employee": {"hire_date": "%d-%m-%Y %H:%M", "birthdate": "%d-%m-%Y %H:%M"},
+
+    "invoice": {"invoice_date": "%Y-%m-%d %H:%M:%S"}
+}
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que descobre os csv da pasta do dataset
+# Retorna um dicionário {nome da tabela: caminho do csv}
+def list_tables(dataset_dir="dataset"):
+    tables = {}
+    for csv_name in sorted(os.listdir(dataset_dir)):
+        if(csv_name.endswith(".csv")):
+            tables[csv_name.split(".")[0]] = os.path.join(dataset_dir, csv_name)
+    return(tables)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Versão das regras de tipagem do cache (alterar quando typed_frame mudar, para descartar os arquivos antigos)
+cache_format = "2"
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que reduz os tipos do dataframe para economizar memória
+# Inteiros usam o menor tipo que cabe os valores (com NULL, o inteiro do pandas que aceita NA)
+# Textos com muitos valores repetidos (ex.: país, cidade) viram categorias
+def typed_frame(df):
+    for column in df.columns:
+        series = df[column]
+        values = series.dropna()
+        if(len(values) == 0 or pd.api.types.is_datetime64_any_dtype(series) or pd.api.types.is_bool_dtype(series)):
+            continue
+
+        if(pd.api.types.is_numeric_dtype(series)):
+            if(pd.api.types.is_integer_dtype(series) or (values % 1 == 0).all()):
+                for dtype in [np.int8, np.int16, np.int32, np.int64]:
+                    if(values.min() >= np.iinfo(dtype).min and values.max() <= np.iinfo(dtype).max):
+                        name = np.dtype(dtype).name
+                        df[column] = series.astype(name if len(values) == len(series) else name.capitalize())
+                        break
+        elif(values.nunique() <= len(values) // 2):
+            df[column] = series.astype("category")
+    return(df)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que lê o csv de uma tabela, já convertendo as colunas de data e reduzindo os tipos
+def parse_table(table_name, csv_path):
+    df = pd.read_csv(csv_path)
+
+    # Ajusta tipos específicos para datetime
+    for column, date_format in date_columns.get(table_name, {}).items():
+        df[column] = pd.to_datetime(df[column], format=date_format)
+
+    return(typed_frame(df))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que grava o dataframe tipado no cache (Arrow/Feather sem compressão, para ser lido por memory map)
+# Cada coluna fica em um único bloco contínuo (um só record batch): dividida em vários, a leitura teria que
+# juntar os pedaços em uma cópia
+# A origem (mtime, tamanho e hash do csv) fica nos metadados do arquivo, junto com os tipos do pandas
+# O arquivo é escrito em um temporário e trocado de uma vez, para uma leitura nunca ver o arquivo pela metade
+def write_cached_table(df, path, source):
+    table = pyarrow.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata.update({key.encode(): str(value).encode() for key, value in source.items()})
+    feather.write_feather(table.replace_schema_metadata(metadata), path + ".tmp", compression="uncompressed",
+                          chunksize=max(len(df), 1))
+    os.replace(path + ".tmp", path)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que converte a tabela lida do cache em dataframe
+# As colunas numéricas sem NULL apontam direto para o arquivo mapeado (sem cópia, somente leitura; o sistema
+# carrega as páginas sob demanda e pode descartá-las), os textos, categorias e datas são copiados para a memória
+def cached_frame(table):
+    return(table.to_pandas(split_blocks=True, self_destruct=True))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que lê a tabela do cache binário, convertendo o csv só quando ele mudou
+# O arquivo vale enquanto o csv tiver o mesmo mtime e tamanho; se só o mtime mudou (ex.: novo checkout),
+# o hash do conteúdo confirma e os metadados são atualizados
+def read_cached_table(table_name, csv_path, cache_dir):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, table_name + ".feather")
+    stat = os.stat(csv_path)
+    source = {"format": cache_format, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+    table = None
+    cached = {}
+    if(os.path.exists(path)):
+        table = feather.read_table(path, memory_map=True)
+        cached = {key.decode(): value.decode() for key, value in (table.schema.metadata or {}).items()}
+        if(all(cached.get(key) == str(value) for key, value in source.items())):
+            return(cached_frame(table))
+
+    source["sha256"] = file_hash(csv_path)
+    if(table is not None and cached.get("format") == cache_format and cached.get("sha256") == source["sha256"]):
+        df = cached_frame(table)
+    else:
+        df = parse_table(table_name, csv_path)
+    write_cached_table(df, path, source)
+    return(df)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que lê a tabela de um csv
+# Com a pasta do cache (e o pyarrow instalado), lê a versão binária já tipada em vez de interpretar o texto
+def read_table(table_name, csv_path, cache_dir=None):
+    if(cache_dir is not None and pyarrow is not None):
+        return(read_cached_table(table_name, csv_path, cache_dir))
+    return(parse_table(table_name, csv_path))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que retorna o nome original de uma tabela auxiliar
+# (as cópias auxiliares usam o sufixo "__", ex.: track__staging)
+def base_table(table_name):
+    return(table_name.split("__")[0])
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que lê apenas o cabeçalho do csv (nomes das colunas)
+def read_header(csv_path):
+    with open(csv_path, encoding="utf-8-sig") as f:
+        return(f.readline().strip().split(","))
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,230 @@
+# ---------------------------------------------------------------------------------------------------------------------
+# Gerador de dados sintéticos: aumenta o dataset por um fator de escala mantendo as chaves estrangeiras
+# Glenda Proença Train
+# ---------------------------------------------------------------------------------------------------------------------
+import os
+import json
+import time
+import shutil
+import argparse
+from math import gcd
+import numpy as np
+import pandas as pd
+from dataset import list_tables
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Nome do arquivo que descreve o dataset gerado (escala, semente e linhas de cada tabela)
+marker_name = "generate.json"
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Tabelas de referência copiadas sem alteração (não crescem com o volume de vendas)
+fixed_tables = ["genre", "media_type", "playlist", "employee"]
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que sorteia n ids de 1 a size com distribuição de Zipf (a posição r tem peso 1 / r^skew)
+# Usa a inversa da distribuição contínua, sem montar a tabela de pesos (size pode ter milhões de itens)
+# As posições são espalhadas pelos ids com um passo primo com size (o mais popular não é sempre o id 1)
+def zipf_ids(rng, n, size, skew=1.0):
+    u = rng.random(n)
+    if(skew == 1.0):
+        ranks = np.floor((size + 1) ** u)
+    else:
+        ranks = np.floor((((size + 1) ** (1 - skew) - 1) * u + 1) ** (1 / (1 - skew)))
+    ranks = np.clip(ranks.astype(np.int64), 1, size)
+
+    stride = max(1, int(size * 0.618))
+    while(gcd(stride, size) != 1):
+        stride += 1
+    return((ranks - 1) * stride % size + 1)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que grava um pedaço da tabela no csv (o cabeçalho só no primeiro pedaço)
+def append_csv(df, path):
+    df.to_csv(path, mode="a", header=not os.path.exists(path), index=False)
+    return(len(df))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que grava a tabela original seguida de scale - 1 cópias
+# offsets: {coluna: passo} somado b * passo aos ids da cópia b (a própria chave e as chaves estrangeiras)
+# suffixes: colunas de texto que recebem o número da cópia (ex.: "AC/DC 2")
+# transform(df, b): ajuste extra de cada cópia
+# Várias cópias são gravadas por vez, até chunk_size linhas
+def write_copies(original, path, scale, offsets, suffixes=(), transform=None, chunk_size=100000):
+    per_chunk = max(1, chunk_size // len(original))
+    rows = 0
+    for first in range(0, scale, per_chunk):
+        blocks = []
+        for block in range(first, min(first + per_chunk, scale)):
+            df = original.copy()
+            for column, step in offsets.items():
+                df[column] = df[column] + block * step
+            if(block > 0):
+                for column in suffixes:
+                    df[column] = df[column] + " {}".format(block + 1)
+                if(transform is not None):
+                    df = transform(df, block)
+            blocks.append(df)
+        rows += append_csv(pd.concat(blocks, ignore_index=True), path)
+    return(rows)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que sorteia as notas e os itens, um pedaço de notas por vez
+# Clientes e faixas seguem Zipf; a quantidade de itens por nota segue a distribuição do original
+# As datas crescem dentro do período do original e o endereço de cobrança é o do cliente
+# O total da nota é a soma dos itens
+def write_invoices(rng, original, path, scale, skew, chunk_size=100000):
+    customers = original["customer"]
+    tracks = original["track"]
+    invoices = original["invoice"]
+    prices = tracks["unit_price"].astype(float).to_numpy()
+    lines_per_invoice = original["invoice_line"].groupby("invoice_id").size().to_numpy()
+    dates = pd.to_datetime(invoices["invoice_date"], format="%Y-%m-%d %H:%M:%S")
+    first_day = dates.min()
+    days = (dates.max() - first_day).days + 1
+
+    total_invoices = len(invoices) * scale
+    per_chunk = max(1, chunk_size // int(lines_per_invoice.mean()))
+    line_id = 0
+    counts = [0, 0]
+    for start in range(0, total_invoices, per_chunk):
+        n = min(per_chunk, total_invoices - start)
+        invoice_id = np.arange(start + 1, start + n + 1)
+        customer_id = zipf_ids(rng, n, len(customers) * scale, skew)
+        template = customers.iloc[(customer_id - 1) % len(customers)].reset_index(drop=True)
+
+        # Cada pedaço fica com a sua fatia do período, para as datas crescerem de um pedaço para o outro
+        low = days * start / total_invoices
+        high = days * (start + n) / total_invoices
+        day = np.floor(np.sort(rng.uniform(low, high, n))).astype(np.int64)
+
+        lines = rng.choice(lines_per_invoice, n)
+        line_invoice = np.repeat(invoice_id, lines)
+        track_id = zipf_ids(rng, len(line_invoice), len(tracks) * scale, skew)
+        unit_price = prices[(track_id - 1) % len(tracks)]
+        total = np.bincount(line_invoice - start - 1, weights=unit_price, minlength=n).round(2)
+
+        counts[0] += append_csv(pd.DataFrame({
+            "invoice_id": invoice_id,
+            "customer_id": customer_id,
+            "invoice_date": (first_day + pd.to_timedelta(day, unit="D")).strftime("%Y-%m-%d %H:%M:%S"),
+            "billing_address": template["address"],
+            "billing_city": template["city"],
+            "billing_state": template["state"],
+            "billing_country": template["country"],
+            "billing_postal_code": template["postal_code"],
+            "total": total}), path["invoice"])
+
+        counts[1] += append_csv(pd.DataFrame({
+            "invoice_line_id": np.arange(line_id + 1, line_id + len(line_invoice) + 1),
+            "invoice_id": line_invoice,
+            "track_id": track_id,
+            "unit_price": unit_price,
+            "quantity": 1}), path["invoice_line"])
+        line_id += len(line_invoice)
+    return(counts)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que gera o dataset na escala informada (scale = 100 tem cerca de 100 vezes as linhas do original)
+# - genre, media_type, playlist e employee são copiadas
+# - artist, album, track, customer e playlist_track são o original seguido de cópias com ids deslocados;
+#   cada álbum copiado vai para um artista sorteado com Zipf (poucos artistas concentram muitos álbuns)
+# - invoice e invoice_line são sorteadas (ver write_invoices)
+# Gêneros e países mantêm a proporção do original, pois cada cópia repete as faixas e os clientes originais
+# Os csv são gravados aos pedaços, sem manter a tabela inteira em memória
+# Retorna {tabela: linhas gravadas}
+def generate_dataset(scale, output_dir, dataset_dir="dataset", seed=0, skew=1.0, chunk_size=100000):
+    sources = list_tables(dataset_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    for table in sources:
+        if(os.path.exists(os.path.join(output_dir, table + ".csv"))):
+            os.remove(os.path.join(output_dir, table + ".csv"))
+    path = {table: os.path.join(output_dir, table + ".csv") for table in sources}
+
+    # A escala 1 é o próprio dataset original
+    copied = list(sources) if scale == 1 else fixed_tables
+    counts = {}
+    for table in copied:
+        shutil.copyfile(sources[table], path[table])
+        counts[table] = len(pd.read_csv(sources[table], usecols=[0]))
+    if(scale == 1):
+        return(counts)
+
+    # Os textos são lidos como estão no csv (vazio continua vazio), só os ids viram números
+    original = {}
+    for table in sources:
+        if(table not in fixed_tables):
+            df = pd.read_csv(sources[table], dtype=str, keep_default_na=False, encoding="utf-8-sig")
+            for column in [column for column in df.columns if column.endswith("_id")]:
+                df[column] = df[column].astype(np.int64)
+            original[table] = df if table == "playlist_track" else df.sort_values(df.columns[0], ignore_index=True)
+
+    rng = np.random.default_rng(seed)
+    artists = len(original["artist"])
+    albums = len(original["album"])
+    tracks = len(original["track"])
+    customers = len(original["customer"])
+
+    counts["artist"] = write_copies(original["artist"], path["artist"], scale, {"artist_id": artists},
+                                    ["artist_name"], chunk_size=chunk_size)
+
+    def album_artist(df, block):
+        df["artist_id"] = zipf_ids(rng, len(df), artists * scale, skew)
+        return(df)
+    counts["album"] = write_copies(original["album"], path["album"], scale, {"album_id": albums}, ["title"],
+                                   album_artist, chunk_size)
+
+    counts["track"] = write_copies(original["track"], path["track"], scale,
+                                   {"track_id": tracks, "album_id": albums}, ["track_name"], chunk_size=chunk_size)
+
+    def customer_email(df, block):
+        df["email"] = df["email"].str.replace("@", "+{}@".format(block + 1), n=1, regex=False)
+        return(df)
+    counts["customer"] = write_copies(original["customer"], path["customer"], scale, {"customer_id": customers},
+                                      transform=customer_email, chunk_size=chunk_size)
+
+    counts["playlist_track"] = write_copies(original["playlist_track"], path["playlist_track"], scale,
+                                            {"track_id": tracks}, chunk_size=chunk_size)
+
+    counts["invoice"], counts["invoice_line"] = write_invoices(rng, original, path, scale, skew, chunk_size)
+    return(counts)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que lê a descrição do dataset gerado (None se a pasta não tiver sido gerada por este script)
+def read_marker(output_dir):
+    marker = os.path.join(output_dir, marker_name)
+    if(not os.path.exists(marker)):
+        return(None)
+    with open(marker) as f:
+        return(json.load(f))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que gera o dataset, caso a pasta ainda não tenha um dataset com os mesmos parâmetros
+# Retorna a descrição do dataset (parâmetros, linhas de cada tabela e tempo de geração)
+def ensure_dataset(scale, output_dir, dataset_dir="dataset", seed=0, skew=1.0, chunk_size=100000):
+    params = {"scale": scale, "seed": seed, "skew": skew}
+    marker = read_marker(output_dir)
+    if(marker is not None and marker["params"] == params):
+        print("Generate: escala {} já gerada em {}".format(scale, output_dir))
+        return(marker)
+
+    start = time.perf_counter()
+    counts = generate_dataset(scale, output_dir, dataset_dir, seed, skew, chunk_size)
+    marker = {"params": params, "rows": counts, "seconds": time.perf_counter() - start}
+    with open(os.path.join(output_dir, marker_name), "w") as f:
+        json.dump(marker, f, indent=2)
+    print("Generate: escala {} em {:.1f}s ({} linhas)".format(scale, marker["seconds"], sum(counts.values())))
+    return(marker)
+# ---------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gera um dataset sintético maior a partir do original")
+    parser.add_argument("--scale", type=int, required=True, help="fator de escala (ex.: 1, 100, 10000)")
+    parser.add_argument("--output", required=True, help="pasta dos csv gerados")
+    parser.add_argument("--dataset", default="dataset", help="pasta do dataset original")
+    parser.add_argument("--seed", type=int, default=0, help="semente do sorteio (a mesma semente gera os mesmos csv)")
+    parser.add_argument("--skew", type=float, default=1.0,
+                        help="expoente de Zipf da popularidade de artistas, faixas e clientes (0 = uniforme)")
+    parser.add_argument("--chunk-size", type=int, default=100000, help="linhas gravadas por vez")
+    args = parser.parse_args()
+    ensure_dataset(args.scale, args.output, args.dataset, args.seed, args.skew, args.chunk_size)
+# ---------------------------------------------------------------------------------------------------------------------
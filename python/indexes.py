@@ -0,0 +1,217 @@
+# ---------------------------------------------------------------------------------------------------------------------
+# Índices secundários e consultor de índices (EXPLAIN ANALYZE) para as consultas das questões
+# Glenda Proença Train
+# ---------------------------------------------------------------------------------------------------------------------
+import re
+import time
+import argparse
+from metrics import execute_ddl
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Define os índices secundários de cada tabela [nome, colunas]
+# Os compostos cobrem as junções/filtros e as colunas agregadas das consultas (evitam a leitura da linha inteira)
+secondary_indexes = {
+    "invoice_line": [["idx_invoice_line_track", ["track_id", "invoice_id", "quantity", "unit_price"]],
+                     ["idx_invoice_line_invoice", ["invoice_id", "track_id", "quantity", "unit_price"]]],
+
+    "track": [["idx_track_genre", ["genre_id", "album_id"]],
+              ["idx_track_album", ["album_id", "genre_id"]],
+              ["idx_track_milliseconds", ["milliseconds"]]],
+
+    "invoice": [["idx_invoice_customer", ["customer_id", "total"]],
+                ["idx_invoice_country", ["billing_country", "total"]],
+                ["idx_invoice_city", ["billing_city", "total"]],
+                ["idx_invoice_total", ["total"]]],
+
+    "customer": [["idx_customer_country", ["country"]]],
+
+    "employee": [["idx_employee_hire_date", ["hire_date"]]],
+
+    "genre": [["idx_genre_name", ["genre_name"]]]
+}
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que descobre os índices de cada tabela: {tabela: {nome do índice: [colunas]}}
+def table_indexes(connection):
+    indexes = {}
+    with connection.cursor(buffered=True) as cursor:
+        cursor.execute("SELECT TABLE_NAME, INDEX_NAME, COLUMN_NAME FROM information_schema.STATISTICS \
+                        WHERE TABLE_SCHEMA = DATABASE() \
+                        ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX")
+        for table, index, column in cursor.fetchall():
+            indexes.setdefault(table, {}).setdefault(index, []).append(column)
+    return(indexes)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que cria os índices secundários que ainda não existem (um único ALTER TABLE por tabela)
+# O sufixo cria os índices nas cópias auxiliares (ex.: track__staging), antes da troca
+def create_indexes(connection, suffix=""):
+    existing = table_indexes(connection)
+    with connection.cursor() as cursor:
+        for table in secondary_indexes:
+            current = existing.get(table + suffix)
+            if(current is None):
+                continue
+
+            missing = [index for index in secondary_indexes[table] if index[0] not in current]
+            if(len(missing) == 0):
+                continue
+
+            print("Index: adicionando {} índices em {}".format(len(missing), table))
+            execute_ddl(cursor, "ALTER TABLE {} {}".format(table + suffix,
+                                                            ", ".join("ADD INDEX {} ({})".format(index[0],
+                                                                                                  ", ".join(index[1]))
+                                                                      for index in missing)))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que cria os índices secundários com o CREATE INDEX padrão (bancos embarcados, sem o information_schema)
+def create_portable_indexes(connection, tables):
+    with connection.cursor() as cursor:
+        for table in secondary_indexes:
+            if(table not in tables):
+                continue
+            print("Index: adicionando {} índices em {}".format(len(secondary_indexes[table]), table))
+            for index in secondary_indexes[table]:
+                execute_ddl(cursor, "CREATE INDEX IF NOT EXISTS {} ON {} ({})".format(index[0], table,
+                                                                                     ", ".join(index[1])))
+    connection.commit()
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que mede o tempo de cada consulta (menor tempo entre as repetições, incluindo a leitura do resultado)
+# Retorna {nome da consulta: segundos}
+def time_queries(connection, queries, repeat=3):
+    latencies = {}
+    with connection.cursor(buffered=True) as cursor:
+        for name, query in queries.items():
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                cursor.execute(query["sql"], query["params"])
+                cursor.fetchall()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            latencies[name] = best
+    return(latencies)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que analisa o plano executado de uma consulta (EXPLAIN ANALYZE)
+# Retorna as tabelas lidas por inteiro, se há ordenação (filesort) e o plano em texto
+def explain_query(connection, sql, params=None):
+    with connection.cursor(buffered=True) as cursor:
+        cursor.execute("EXPLAIN ANALYZE " + sql, params)
+        plan = "\n".join(row[0] for row in cursor.fetchall())
+
+    # Tabelas temporárias das CTEs/subconsultas (ex.: "<temporary>") não entram como leitura completa
+    full_scans = sorted(set(re.findall(r"Table scan on (\w+)", plan)))
+    filesort = re.search(r"-> Sort\b", plan) is not None
+    return({"full_scans": full_scans, "filesort": filesort, "plan": plan})
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Reconhece as tabelas lidas pela consulta e o apelido de cada uma (ex.: FROM invoice AS i, JOIN track)
+table_reference_pattern = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(?!(?:ON|INNER|LEFT|RIGHT|CROSS|JOIN|WHERE|"
+                                     r"GROUP|ORDER|HAVING|LIMIT|UNION)\b)(\w+))?", re.IGNORECASE)
+
+# Reconhece o início de cada cláusula; as cláusulas ON, WHERE, GROUP BY e ORDER BY são os grupos de predicados
+clause_pattern = re.compile(r"\b(SELECT|FROM|JOIN|ON|WHERE|GROUP\s+BY|HAVING|ORDER\s+BY|LIMIT)\b", re.IGNORECASE)
+
+# Reconhece as agregações, cujas colunas não são usadas para localizar linhas (ex.: SUM(invoice.total))
+aggregate_pattern = re.compile(r"\b(?:COUNT|SUM|AVG|MIN|MAX)\s*\([^()]*\)", re.IGNORECASE)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que separa os grupos de predicados da consulta: o texto de cada ON, WHERE, GROUP BY e ORDER BY
+# (sem as agregações), na ordem em que aparecem
+def predicate_groups(sql):
+    matches = list(clause_pattern.finditer(sql))
+    groups = []
+    for position, match in enumerate(matches):
+        keyword = re.sub(r"\s+", " ", match.group(1)).upper()
+        if(keyword in ["ON", "WHERE", "GROUP BY", "ORDER BY"]):
+            end = matches[position + 1].start() if position + 1 < len(matches) else len(sql)
+            groups.append(aggregate_pattern.sub(" ", sql[match.end():end]))
+    return(groups)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que sugere índices para as tabelas lidas por inteiro
+# Cada grupo de predicados (junção, filtro, agrupamento e ordenação) gera um índice com as colunas da tabela
+# usadas nele, na ordem em que aparecem: a coluna qualificada precisa ser da tabela (ou do seu apelido) e a
+# coluna sem tabela só conta se nenhuma outra tabela da consulta tiver uma coluna com o mesmo nome
+# Os grupos que já são o início de um índice existente não geram sugestão
+def suggest_indexes(connection, sql, full_scans, indexes):
+    aliases = {}
+    for table, alias in table_reference_pattern.findall(sql):
+        aliases[table.lower()] = table
+        aliases[(alias or table).lower()] = table
+    tables = sorted(set(aliases.values()))
+    if(len(tables) == 0):
+        return([])
+
+    columns = {}
+    with connection.cursor(buffered=True) as cursor:
+        cursor.execute("SELECT TABLE_NAME, COLUMN_NAME FROM information_schema.COLUMNS \
+                        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({})".format(", ".join(["%s"] * len(tables))),
+                       tables)
+        for table, column in cursor.fetchall():
+            columns.setdefault(table, set()).add(column)
+
+    suggestions = []
+    for scan in full_scans:
+        table = aliases.get(scan.lower(), scan)
+        others = set().union(*[columns[other] for other in columns if other != table])
+        existing = list(indexes.get(table, {}).values())
+        suggested = []
+        for group in predicate_groups(sql):
+            used = []
+            for qualifier, column in re.findall(r"\b(?:(\w+)\s*\.\s*)?(\w+)\b", group):
+                if(column not in columns.get(table, set()) or column in used):
+                    continue
+                if((qualifier != "" and aliases.get(qualifier.lower()) == table) or
+                   (qualifier == "" and column not in others)):
+                    used.append(column)
+            if(len(used) == 0 or used in suggested or any(index[:len(used)] == used for index in existing)):
+                continue
+            suggested.append(used)
+            suggestions.append("ALTER TABLE {} ADD INDEX ({})".format(table, ", ".join(used)))
+    return(suggestions)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que gera o relatório dos índices: latência antes e depois da criação dos índices secundários,
+# leituras completas e ordenações que sobraram em cada consulta, e os índices sugeridos
+def index_report(connection, queries, create=True, repeat=3):
+    before = time_queries(connection, queries, repeat)
+    if(create):
+        create_indexes(connection)
+        after = time_queries(connection, queries, repeat)
+    else:
+        after = before
+
+    indexes = table_indexes(connection)
+    print("\nRelatório dos índices:")
+    print("   {:<24} {:>12} {:>12}  {}".format("Consulta", "Antes(ms)", "Depois(ms)", "Planos"))
+    for name, query in queries.items():
+        explain = explain_query(connection, query["sql"], query["params"])
+        notes = []
+        if(len(explain["full_scans"]) > 0):
+            notes.append("leitura completa: {}".format(", ".join(explain["full_scans"])))
+        if(explain["filesort"]):
+            notes.append("filesort")
+        print("   {:<24} {:>12.2f} {:>12.2f}  {}".format(name, before[name] * 1000, after[name] * 1000,
+                                                      "; ".join(notes) if len(notes) > 0 else "ok"))
+        for suggestion in suggest_indexes(connection, query["sql"], explain["full_scans"], indexes):
+            print("   {:<24} sugestão: {}".format("", suggestion))
+    return(before, after)
+# ---------------------------------------------------------------------------------------------------------------------
+
+if __name__ == "__main__":
+
+    # Consultor de índices sobre o banco já carregado
+    parser = argparse.ArgumentParser(description="Analisa as consultas das questões e sugere índices")
+    parser.add_argument("--create", action="store_true", help="cria os índices secundários que estiverem faltando")
+    parser.add_argument("--repeat", type=int, default=3, help="repetições de cada consulta na medição")
+    args = parser.parse_args()
+
+    from insert_data import connect_db
+    from queries import queries
+
+    connection, engine, pool = connect_db()
+    index_report(connection, queries, args.create, args.repeat)
+# ---------------------------------------------------------------------------------------------------------------------
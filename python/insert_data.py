@@ -4,10 +4,33 @@
 # ---------------------------------------------------------------------------------------------------------------------
 import os
 import sys
+import time
 import json
-import pandas as pd
+import random
+import argparse
+from datetime import datetime
 import mysql.connector as mysql
+from mysql.connector import pooling
+from mysql.connector import errorcode
+from mysql.connector.constants import ClientFlag
 from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+from dataset import list_tables, read_table
+from bulk_load import strategies, backend_strategies, choose_strategies, load_table, upsert_table, load_stats, print_load_report
+from schema import create_table, drop_tables, set_foreign_key_checks, validate_relationships
+from scheduler import table_dependencies, dependency_levels, run_in_order
+from manifest import file_hash, create_manifest, read_manifest, update_manifest, clear_manifest
+from swap import staging_suffix, swap_tables, rollback_tables
+from queries import queries
+from runner import fetch_modes, run_queries, print_query_report
+from cache import ResultCache
+from materialize import update_summaries, reset_summaries
+from indexes import create_indexes, create_portable_indexes, index_report
+from backends import dialects, connect_embedded
+from analytics import load_frames, cross_check
+from metrics import metrics, span, print_metrics_report
+from partitions import partitioned_tables, partition_spec, add_partition_column, table_partitions, \
+    skip_archived, roll_partitions, archive_partitions
 # ---------------------------------------------------------------------------------------------------------------------
 
 # Define as relações de cada uma das tabelas
@@ -40,399 +63,415 @@ relationships = {
 }
 # ---------------------------------------------------------------------------------------------------------------------
 
-# Função que realiza a conexão no banco de dados
-# Retorna o conector caso tenha sucesso
-# Caso contrário, termina o programa informando erro
-def connect_db(host="mysql", database="sqlproject", credentials_file="credentials.json"):
+# Função que monta a configuração das conexões a partir do arquivo de credenciais
+# Sem o FOUND_ROWS, o upsert conta só as linhas realmente alteradas (as iguais não contam como afetadas)
+def connection_config(host="mysql", database="sqlproject", credentials_file="credentials.json"):
 
     # Abre e lê o arquivo de credenciais
     with open(credentials_file) as f:
         credentials = json.load(f)
 
-    # Conecta na base de dados
-    connection = mysql.connect(
-        user=credentials.get('user'),
-        password=credentials.get('password'),
-        database=database,
-        host=host,
-        port="3306"
-    )
+    return({"user": credentials.get('user'),
+            "password": credentials.get('password'),
+            "database": database,
+            "host": host,
+            "port": "3306",
+            "allow_local_infile": True,
+            "client_flags": [-ClientFlag.FOUND_ROWS]})
+# ---------------------------------------------------------------------------------------------------------------------
 
-    # Cria a engine para converter o dataframe para o formato de tabela do MySQL
-    engine = create_engine("mysql+mysqlconnector://{}:{}@{}/{}".format(credentials.get('user'),
-                                                                       credentials.get('password'),
-                                                                       host,
-                                                                       database))
-    
-    # Verifica a conexão
-    if connection.is_connected():
-        return(connection, engine)
-    else:
-        print("Erro: Não foi possível realizar a conexão!")
+# Função que aguarda o banco aceitar conexões (readiness probe) e cria o pool de conexões
+# A cada falha espera um tempo sorteado entre 0 e o intervalo atual (jitter), que dobra a cada tentativa
+# até o máximo, e desiste quando o prazo acaba ou o acesso é negado (repassa o último erro)
+# O pool abre todas as suas conexões ao ser criado, então a conexão que responde já fica no pool
+def wait_for_pool(config, size, deadline=60, initial_delay=0.1, max_delay=5):
+    start = time.monotonic()
+    delay = initial_delay
+    attempt = 0
+    while(True):
+        attempt += 1
+        try:
+            pool = pooling.MySQLConnectionPool(pool_name="insert_data", pool_size=size, **config)
+            print("MySQL: pronto em {:.2f} s ({} tentativas)".format(time.monotonic() - start, attempt))
+            return(pool)
+        except mysql.Error as error:
+            # Credenciais erradas não se resolvem esperando
+            remaining = deadline - (time.monotonic() - start)
+            if(remaining <= 0 or error.errno == errorcode.ER_ACCESS_DENIED_ERROR):
+                raise
+            print("MySQL: aguardando o banco (tentativa {}: {})".format(attempt, error))
+            time.sleep(min(random.uniform(0, delay), remaining))
+            delay = min(delay * 2, max_delay)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que realiza a conexão no banco de dados
+# Aguarda o banco ficar pronto e cria um único pool, usado pelo DDL, pelas cargas e pelas consultas
+# A engine do SQLAlchemy também pega as conexões desse pool (NullPool: devolve a conexão a cada uso)
+# Retorna a conexão principal, a engine e o pool caso tenha sucesso
+# Caso contrário, termina o programa informando erro
+def connect_db(host="mysql", database="sqlproject", credentials_file="credentials.json", pool_size=5, deadline=60):
+    config = connection_config(host, database, credentials_file)
+    try:
+        pool = wait_for_pool(config, pool_size, deadline)
+    except mysql.Error as error:
+        print("Erro: Não foi possível realizar a conexão! ({})".format(error))
         sys.exit(1)
+
+    # Cria a engine para converter o dataframe para o formato de tabela do MySQL
+    engine = create_engine("mysql+mysqlconnector://", creator=pool.get_connection, poolclass=NullPool)
+    return(pool.get_connection(), engine, pool)
 # ---------------------------------------------------------------------------------------------------------------------
 
-# Função que cria as relações necessárias entre as tabelas
-def create_relationships(connection, relationships):
-    with connection.cursor() as cursor:
-        
-        # Percorre todas as tabelas
-        for table in relationships:
-
-            # Encontra o nome da coluna que vai ser a chave primária
-            p_key = relationships[table]["p_key"]
-            
-            # Adiciona a chave primária
-            if(p_key is not None):
-                print("P_key: adicionando a chave primária {}".format(p_key))
-                
-                # Garante que a coluna vai ser do tipo int
-                cursor.execute("ALTER TABLE {} MODIFY {} INT".format(table, p_key))
-                cursor.execute("ALTER TABLE {} ADD PRIMARY KEY ({})".format(table, p_key))
-
-        # Percorre todas as tabelas (separado, para não dar conflito de tipo)
-        for table in relationships:
-
-            # Chaves estrangeiras
-            if(relationships[table]["f_key"] is not None):
-                for f_key in relationships[table]["f_key"]:
-                    print("F_key: adicionando a chave estrangeira {}".format(f_key[0]))
-                    
-                    # Garante que a coluna vai ser do tipo int
-                    cursor.execute("ALTER TABLE {} MODIFY {} INT".format(table, f_key[0]))
-
-                    # Adiciona a chave estrangeira                        
-                    sql_add_fkey = "ALTER TABLE {} ADD FOREIGN KEY ({}) REFERENCES {}".format(table, f_key[0], f_key[1])
-                    cursor.execute(sql_add_fkey)
+# Função que cria e carrega a tabela de um csv usando uma conexão do pool
+# Na carga incremental (manifest informado), pula o csv que não mudou desde a última carga
+# e aplica o csv alterado como upsert pela chave primária
+# O sufixo carrega o csv em uma cópia auxiliar da tabela (ex.: track__staging)
+# Com a pasta do cache do dataset, o csv é lido da versão binária já tipada (dataset.py)
+# Com partition_months, as tabelas fato são criadas particionadas por períodos de partition_months meses
+# (partitions.py); na carga incremental, uma tabela que já é particionada recebe as partições que faltam
+# para as novas datas (no tamanho das partições que já tem) antes do upsert, e as linhas anteriores à
+# primeira partição (já arquivadas) são ignoradas
+def load_csv_table(pool, engine, table_name, csv_path, order, chunk_size, manifest=None, existing=(), suffix="",
+                   cache_dir=None, partition_months=None, partition_ahead=3):
+    digest = file_hash(csv_path)
+    incremental = manifest is not None and table_name in existing
+    if(incremental and manifest.get(table_name, (None, None))[0] == digest):
+        return(load_stats(table_name, "skip", 0, 0))
+
+    connection = pool.get_connection()
+    try:
+        # Cada conexão do pool é uma sessão nova: desliga as chaves estrangeiras nela também
+        set_foreign_key_checks(connection, False)
+
+        with span("parse", table_name) as record:
+            df = read_table(table_name, csv_path, cache_dir)
+            record.update(rows=len(df), bytes=os.path.getsize(csv_path))
+
+        # Particionamento: na carga completa segue o parâmetro, na incremental segue a tabela existente
+        partition = None
+        partition_column = None
+        if(table_name in partitioned_tables):
+            partitions = table_partitions(connection, table_name) if incremental else []
+            if(len(partitions) > 0):
+                partition_column = partitioned_tables[table_name]["column"]
+                df = skip_archived(table_name, add_partition_column(table_name, df, csv_path, cache_dir), partitions)
+                roll_partitions(connection, table_name, df[partition_column].max(), partition_ahead)
+            elif(not incremental and partition_months is not None):
+                df = add_partition_column(table_name, df, csv_path, cache_dir)
+                partition = partition_spec(table_name, df, partition_months, partition_ahead)
+
+        if(incremental):
+            with span("insert", table_name) as record:
+                stats = upsert_table(connection, table_name, df, relationships[table_name]["p_key"], chunk_size,
+                                     partition_column)
+        else:
+            # Cria a tabela já tipada, com as chaves, e carrega os dados em massa (uma única escrita por tabela)
+            create_table(connection, table_name, df, relationships, suffix, partition)
+            with span("insert", table_name) as record:
+                stats = load_table(connection, engine, table_name + suffix, csv_path, df, order, chunk_size)
+        record.update(rows=len(df), bytes=os.path.getsize(csv_path), strategy=stats["strategy"])
+
+        # O manifesto só é atualizado depois que a carga inteira for validada
+        stats["table"] = table_name
+        stats["file_hash"] = digest
+        stats["rows"] = len(df)
+        return(stats)
+    finally:
+        # Devolve a conexão para o pool
+        connection.close()
 # ---------------------------------------------------------------------------------------------------------------------
 
-# Função que exclui todas as relações e tabelas existentes no banco
-def drop_all_tables(connection, relationships):
+# Função que descobre as tabelas que já existem no banco
+def existing_tables(connection):
     with connection.cursor(buffered=True) as cursor:
-
-        # Percorre todas as tabelas removendo a chave estrangeira
-        for table in relationships:
-
-            # Descobre as colunas da tabela (se ela existir)
-            try:
-                cursor.execute("DESCRIBE {}".format(table))
-            except:
-                continue
-
-            # Para cada coluna, remove a chave estrangeira (se existir)
-            rows = cursor.fetchall()
-            for row in rows:
-                column = row[0]
-                # Define a chave estrangeira como várias opções (o banco pode salver como o nome da coluna 
-                # ou com o sufixo _ibfk)
-                for f_key in [column, table + "_ibfk_1", table + "_ibfk_2", table + "_ibfk_3"]:
-                    try:
-                        cursor.execute("ALTER TABLE {} DROP FOREIGN KEY {}".format(table, f_key))
-                    except:
-                        continue
-
-        # Após remover as chaves estrangeiras, faz o drop das tabelas
-        for table in relationships:
-            try:
-                cursor.execute("DROP TABLE {}".format(table))
-            except mysql.errors.ProgrammingError:
-                continue
+        cursor.execute("SHOW TABLES")
+        return({row[0] for row in cursor.fetchall()})
 # ---------------------------------------------------------------------------------------------------------------------
 
-# Função que resolve os exercícios propostos no GitHub
-def solve_questions(connection):
-    with connection.cursor(buffered=True) as cursor:
+# Função que exclui todas as relações e tabelas existentes no banco
+# As chaves estrangeiras são descobertas pelo information_schema (o sufixo seleciona as cópias auxiliares)
+def drop_all_tables(connection, relationships, suffix=""):
+    drop_tables(connection, [table + suffix for table in relationships])
+# ---------------------------------------------------------------------------------------------------------------------
 
-        # Qual é o gênero musical mais popular?
-        cursor.execute("SELECT COUNT(track.genre_id) AS popularity, genre.genre_name \
-                        FROM track \
-                        JOIN genre ON track.genre_id = genre.genre_id \
-                        GROUP BY genre.genre_name \
-                        ORDER BY popularity DESC LIMIT 1")
-        
-        rows = cursor.fetchall()
-        answer = rows[0][1]
-        print("\n1) Qual é o gênero musical mais popular?")
-        print("   R: {}".format(answer))
-
-        # Qual é o artista mais popular?
-        cursor.execute("SELECT COUNT(invoice_line.quantity) AS purchases, artist.artist_name AS artist_name \
-                        FROM invoice_line \
-                        INNER JOIN track ON track.track_id = invoice_line.track_id \
-                        INNER JOIN album ON track.album_id = album.album_id \
-                        INNER JOIN artist ON artist.artist_id = album.artist_id \
-                        GROUP BY artist_name \
-                        ORDER BY purchases DESC \
-                        LIMIT 1")
-        
-        rows = cursor.fetchall()
-        answer = rows[0][1]
-        print("\n2) Qual é o artista mais popular?")
-        print("   R: {}".format(answer))
-
-        # Qual é a música mais popular?
-        cursor.execute("SELECT COUNT(invoice_line.quantity) AS purchases, track.track_name AS track_name \
-                        FROM invoice_line \
-                        INNER JOIN track ON track.track_id = invoice_line.track_id \
-                        GROUP BY track_name \
-                        ORDER BY purchases DESC \
-                        LIMIT 1")
-        
-        rows = cursor.fetchall()
-        answer = rows[0][1]
-        print("\n3) Qual é a música mais popular?")
-        print("   R: {}".format(answer))
-
-        # Qual é o preço médio de diferentes tipo de música?
-        cursor.execute("WITH purchases AS \
-	                    (SELECT SUM(invoice.total) AS total_spent, genre.genre_name AS genre \
-	                    FROM invoice \
-	                    INNER JOIN invoice_line ON invoice_line.invoice_id = invoice.invoice_id \
-	                    INNER JOIN track ON track.track_id = invoice_line.track_id \
-	                    INNER JOIN genre ON genre.genre_id = track.genre_id \
-	                    GROUP BY genre.genre_name \
-                        ORDER BY total_spent) \
-                        SELECT genre, CONCAT('$', ROUND(AVG(total_spent))) AS total \
-                        FROM purchases \
-                        GROUP BY genre")
-        
-        rows = cursor.fetchall()
-        print("\n4) Qual é o preço médio de diferentes tipo de música?")
-        for row in rows:
-            print("    {}: {}".format(row[0], row[1]))
-
-        # Qual é o país mais popular em compras de música?
-        cursor.execute("SELECT SUM(invoice_line.quantity) AS invoice_quantity, customer.country AS country \
-                        FROM invoice_line \
-                        INNER JOIN invoice ON invoice.invoice_id = invoice_line.invoice_line_id \
-                        INNER JOIN customer ON customer.customer_id = invoice.customer_id \
-                        GROUP BY country \
-                        ORDER BY invoice_quantity DESC \
-                        LIMIT 1")
-        
-        rows = cursor.fetchall()
-        answer = rows[0][1]
-        print("\n5) Qual é o país mais popular em compras de música?")
-        print("   R: {}".format(answer))
-
-        # Quem é o funcionário mais antigo?
-        cursor.execute("SELECT first_name, last_name FROM employee \
-                        ORDER BY hire_date ASC \
-                        LIMIT 1")
-        rows = cursor.fetchall()
-        first_name = rows[0][0]
-        last_name = rows[0][1]
-        print("\n6) Quem é o funcionário mais antigo?")
-        print("   R: {} {}".format(first_name, last_name))
-
-        # Qual país tem a maior quantidade de faturas?
-        cursor.execute("SELECT COUNT(invoice_id) as invoice_quantity, billing_country \
-                       FROM invoice \
-                       GROUP BY billing_country \
-                       ORDER BY invoice_quantity DESC")
-        
-        rows = cursor.fetchall()
-        answer = rows[0][1]
-        print("\n7) Qual país tem a maior quantidade de faturas?")
-        print("   R: {}".format(answer))
-
-        # Qual é o top 3 em valores da fatura total?
-        cursor.execute("SELECT * FROM invoice \
-                       ORDER BY total DESC \
-                       LIMIT 3")
-        rows = cursor.fetchall()
-        print("\n8) Qual é o top 3 em valores da fatura total?")
-        print("   R:")
-        print("   {}".format(rows[0]))
-        print("   {}".format(rows[1]))
-        print("   {}".format(rows[2]))
-
-        # Qual cidade tem os melhores clientes?
-        # Nós gostaríamos de dar um festival promocional na cidade em que conseguimos mais dinheiro.
-        # Escreva uma consulta que retorne uma cidade que tenha a maior soma de totais de faturas.
-        # Retorne o nome da cidade e a soma de todos os totais da fatura.
-        cursor.execute("SELECT billing_city, CONCAT(\"$\", ROUND(SUM(total), 2)) AS invoice_total \
-                        FROM invoice \
-                        GROUP BY billing_city \
-                        ORDER BY SUM(total) DESC \
-                        LIMIT 1")
-        rows = cursor.fetchall()
-        city = rows[0][0]
-        invoice_total = rows[0][1]
-        print("\n9) Qual cidade tem os melhores clientes?")
-        print("   R: {} com um total de faturas de {}".format(city, invoice_total))
-        
-        # Quem é o melhor cliente? O cliente que gastou mais dinheiro será declarado o melhor cliente.
-        # Escreva uma consulta que retorne a pessoa que gastou mais dinheiro.
-        cursor.execute("SELECT CONCAT(\"$\", ROUND(SUM(invoice.total), 2)) AS invoice_total, customer.first_name, customer.last_name \
-                        FROM invoice \
-                        INNER JOIN customer ON customer.customer_id = invoice.customer_id \
-                        GROUP BY customer.customer_id \
-                        ORDER BY SUM(invoice.total) DESC")
-        rows = cursor.fetchall()
-        customer_name = rows[0][1] + " " + rows[0][2]
-        invoice_total = rows[0][0]
-        print("\n10)  Quem é o melhor cliente?")
-        print("   R: {} com um total de faturas de {}".format(customer_name, invoice_total))
-
-        # Escreva uma consulta para retornar o e-mail, nome, sobrenome e gênero de todos os ouvintes de rock. 
-        # Devolva sua lista ordenada em ordem alfabética por e-mail começando com A.
-        cursor.execute("SELECT DISTINCT customer.first_name, customer.last_name, customer.email, genre.genre_name \
-                        FROM customer \
-                        INNER JOIN invoice ON invoice.customer_id = customer.customer_id \
-                        INNER JOIN invoice_line ON invoice_line.invoice_id = invoice.invoice_id \
-                        INNER JOIN track ON track.track_id = invoice_line.track_id \
-                        INNER JOIN genre ON genre.genre_id = track.genre_id \
-                        WHERE genre.genre_name = 'Rock' \
-                        ORDER BY customer.email ASC")
-        print("\n11) Quais são os emails ordenados dos ouvintes de rock?")
-        print("   R:")
-        rows = cursor.fetchall()
-        for row in rows[:10]:
-            print("   {}".format(row))
-        print("   ...")
-
-
-        cursor.execute("SELECT COUNT(track.track_id) AS num_songs, artist.artist_name \
-                        FROM track \
-                        INNER JOIN album ON album.album_id = track.album_id \
-                        INNER JOIN artist ON artist.artist_id = album.artist_id \
-                        WHERE genre_id \
-	                    IN (SELECT genre.genre_id FROM genre \
-		                WHERE genre.genre_name = \"Rock\") \
-                        GROUP BY artist.artist_id \
-                        ORDER BY num_songs DESC \
-                        LIMIT 10;")
-        
-        # Vamos convidar os artistas que mais escreveram rock em nosso conjunto de dados.
-        # Escreva uma consulta que retorne o nome do artista e a contagem total de faixas das 10 principais bandas de rock.
-        print("\n12) Quais as 10 principais bandas de rock?")
-        print("   R: (Número de Músicas x Bandas)")
-        rows = cursor.fetchall()
-        for row in rows[:10]:
-            print("   {}".format(row))
-        print("   ...")
-
-        # Retorna todos os nomes de faixas que possuem uma duração de música maior que a duração média da música.
-        # Retorna o nome e os milissegundos de cada faixa. Ordene pela duração da música com as músicas mais longas
-        # listadas primeiro.
-        cursor.execute("SELECT track.track_name, track.milliseconds FROM track \
-                        WHERE track.milliseconds > \
-	                        (SELECT AVG(milliseconds) FROM track) \
-                        ORDER BY track.milliseconds DESC")
-        print("\n13) Quais são as faixas que tem duração maior do que média?")
-        print("   R: (Música x Duração(ms))")
-        rows = cursor.fetchall()
-        for row in rows[:10]:
-            print("   {}".format(row))
-        print("   ...")
-
-        # Descubra quanto valor gasto por cada cliente com artistas.
-        # Escreva uma consulta para retornar o nome do cliente, o nome do artista e o total gasto.
-        cursor.execute("WITH artists_name AS \
-	                        (SELECT artist.artist_id AS artist_id, \
-		                    artist.artist_name AS artist_name \
-	                        FROM invoice_line \
-	                        JOIN track ON track.track_id = invoice_line.track_id \
-	                        JOIN album ON album.album_id = track.album_id \
-	                        JOIN artist ON artist.artist_id = album.artist_id \
-	                        GROUP BY artist.artist_id) \
-                        SELECT customer.customer_id AS customer_id, \
-	                    customer.first_name AS first_name, \
-	                    artists_name.artist_name AS artist_name, \
-	                    SUM(invoice_line.unit_price * invoice_line.quantity) AS total_spent \
-                        FROM invoice \
-                        JOIN customer ON customer.customer_id = invoice.customer_id \
-                        JOIN invoice_line ON invoice_line.invoice_id = invoice.invoice_id \
-                        JOIN track ON track.track_id = invoice_line.track_id \
-                        JOIN album ON album.album_id = track.album_id \
-                        JOIN artists_name ON artists_name.artist_id = album.artist_id \
-                        GROUP BY 1, 2, 3 \
-                        ORDER BY 4 DESC")
-        print("\n14) Quanto cada cliente gastou com cada artista?")
-        print("   R: (Id x Primeiro Nome Cliente X Nome do Artist x Total de Gastos)")
-        rows = cursor.fetchall()
-        for row in rows[:10]:
-            print("   {}".format(row))  
-        print("   ...")      
-
-        # Queremos descobrir o gênero musical mais popular de cada país.
-        # Determinamos o gênero mais popular como o gênero com maior quantidade de compras.
-        # Escreva uma consulta que retorne cada país junto com o gênero principal.
-        # Para países onde o número máximo de compras é compartilhado, devolva todos os gêneros.
-        cursor.execute("WITH popular_genre AS \
-                            (SELECT COUNT(invoice_line.quantity) AS purchases, \
-		                        customer.country, genre.genre_name AS genre_name, \
-                                ROW_NUMBER() OVER(PARTITION BY customer.country \
-                            ORDER BY COUNT(invoice_line.quantity) DESC) AS row_num \
-                            FROM invoice_line \
-                            INNER JOIN invoice ON invoice.invoice_id = invoice_line.invoice_id \
-                            INNER JOIN customer ON customer.customer_id = invoice.customer_id \
-                            INNER JOIN track ON track.track_id = invoice_line.track_id \
-                            INNER JOIN genre ON genre.genre_id = track.genre_id \
-                            GROUP BY 2, 3 \
-                            ORDER BY 2 ASC, 1 DESC) \
-                        SELECT country, genre_name, purchases \
-                        FROM popular_genre \
-                        WHERE row_num <= 1")
-        print("\n15) Qual o gênero musical mais popular em cada país?")
-        print("   R: (País x Gênero X Vendas)")
-        rows = cursor.fetchall()
-        for row in rows[:10]:
-            print("   {}".format(row))
-        print("   ...") 
-
-        # Escreva uma consulta que determine o cliente que gastou mais em música em cada país.
-        # Escreva uma consulta que retorne o país junto com o principal cliente e quanto ele gastou.
-        # Para países onde o valor mais gasto é compartilhado, forneça todos os clientes que gastaram esse valor.
-        cursor.execute("WITH total_customer_country AS (SELECT customer.first_name, \
-	                    billing_country, \
-                        SUM(invoice.total) AS total_spent, \
-                        ROW_NUMBER() OVER(PARTITION BY billing_country ORDER BY SUM(total) DESC) AS row_num \
-                        FROM customer \
-                        INNER JOIN invoice ON invoice.customer_id = customer.customer_id \
-                        GROUP BY 1, 2 \
-                        ORDER BY 2, total_spent DESC) \
-                        SELECT first_name, billing_country, total_spent \
-                        FROM total_customer_country \
-                        WHERE row_num = 1")
-        print("\n16) Qual cliente gastou mais em cada país?")
-        print("   R: (Nome Cliente x País X Total de Gastos)")
-        rows = cursor.fetchall()
-        for row in rows[:10]:
-            print("   {}".format(row)) 
-        print("   ...")
+# Função que cria, carrega e consulta o banco embarcado (SQLite ou DuckDB) no próprio processo
+# O manifesto, a carga atômica, os resumos e o cache dependem do MySQL e não são usados aqui
+# Retorna as estatísticas da carga e os resultados das consultas
+def run_embedded(backend, path=None, strategy="auto", chunk_size=5000, workers=4, names=None, fetch="preview",
+                 cache_dir=None, check=False, dataset_dir="dataset", date_range=None):
+    with span("phase", "connect"):
+        connection, pool = connect_embedded(backend, path)
+        order = choose_strategies(connection, strategy, backend)
+
+    # Cria e carrega as tabelas na ordem das chaves estrangeiras (o SQLite aceita um escritor por vez)
+    csv_tables = list_tables(dataset_dir)
+    with span("phase", "load"):
+        stats = run_in_order(csv_tables, table_dependencies(relationships),
+                             lambda table_name: load_csv_table(pool, None, table_name, csv_tables[table_name],
+                                                               order, chunk_size, cache_dir=cache_dir),
+                             dialects[backend]["writers"] or workers)
+    print_load_report(stats)
+
+    # Valida as relações e cria os índices secundários
+    with span("phase", "validate"):
+        if(len(validate_relationships(connection, relationships)) > 0):
+            sys.exit(1)
+    with span("phase", "indexes"):
+        if(dialects[backend]["indexes"]):
+            create_portable_indexes(connection, csv_tables)
+
+    # Resolve as questões mencionadas no readme.md (e confere com o motor em memória)
+    with span("phase", "questions"):
+        results = solve_questions(pool, names, workers, fetch, None, False, date_range)
+    if(check):
+        with span("phase", "cross_check"):
+            cross_check(pool, load_frames(dataset_dir, cache_dir), names, workers, False, date_range)
+    return(stats, results)
 # ---------------------------------------------------------------------------------------------------------------------
 
-if __name__ == "__main__": 
+# Função que resolve os exercícios propostos no GitHub
+# As consultas do registro são executadas em paralelo e as respostas impressas na ordem do readme.md
+def solve_questions(pool, names=None, workers=4, fetch="preview", cache=None, summaries=True, date_range=None):
+    start = time.perf_counter()
+    results = run_queries(pool, names, workers, fetch=fetch, cache=cache, summaries=summaries, date_range=date_range)
+    wall = time.perf_counter() - start
+
+    for result in results:
+        query = queries[result["name"]]
+        print("\n" + query["title"])
+        for line in query["format"](result["rows"]):
+            print(line)
+
+    # Mostra o tempo de cada consulta
+    print_query_report(results, wall)
+    return(results)
+# ---------------------------------------------------------------------------------------------------------------------
 
-    # Faz a conexão com o banco de dados
-    connection, engine = connect_db()
+# Função que valida uma data da linha de comando (AAAA-MM-DD)
+def date_argument(value):
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError("data inválida: {} (use AAAA-MM-DD)".format(value))
+    return(value)
+# ---------------------------------------------------------------------------------------------------------------------
 
-    # Exclui as tabelas do banco, caso existam
-    drop_all_tables(connection, relationships)
-    
-    # Descobre o nome dos csv da pasta
-    csv_paths = os.listdir("dataset")
+# Função que monta os parâmetros da linha de comando
+def argument_parser():
+    parser = argparse.ArgumentParser(description="Cria e popula o banco de dados a partir dos csv")
+    parser.add_argument("--backend", default="mysql", choices=["mysql"] + list(dialects),
+                        help="banco usado (sqlite e duckdb rodam no próprio processo, sem o servidor MySQL)")
+    parser.add_argument("--database-file", default=None,
+                        help="arquivo do banco embarcado (padrão: sqlproject.<backend>; :memory: para só memória)")
+    parser.add_argument("--dataset", default="dataset", help="pasta dos csv carregados")
+    parser.add_argument("--strategy", default="auto", choices=["auto"] + list(strategies),
+                        help="estratégia de carga em massa (auto usa a mais rápida que o banco permite)")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="linhas por lote de INSERT")
+    parser.add_argument("--workers", type=int, default=4, help="tabelas carregadas em paralelo (máximo 15)")
+    parser.add_argument("--ready-timeout", type=float, default=60,
+                        help="prazo (s) para o MySQL aceitar conexões antes de desistir")
+    parser.add_argument("--dataset-cache", default=None,
+                        help="pasta do cache binário (Arrow) dos csv já tipados (padrão: <dataset>/.cache)")
+    parser.add_argument("--no-dataset-cache", action="store_true",
+                        help="sempre interpreta os csv, sem usar o cache binário")
+    parser.add_argument("--questions", nargs="+", choices=list(queries), metavar="QUESTION",
+                        help="consultas do registro a executar (padrão: todas)")
+    parser.add_argument("--fetch", default="preview", choices=fetch_modes,
+                        help="leitura do resultado das consultas (preview limita no SQL as linhas mostradas)")
+    parser.add_argument("--cache-dir", default=None,
+                        help="pasta do cache em disco das respostas (por padrão o cache fica só em memória)")
+    parser.add_argument("--cache-size", type=int, default=256, help="tamanho máximo do cache em disco (MB)")
+    parser.add_argument("--cross-check", action="store_true",
+                        help="confere as respostas do SQL com as do motor em memória (analytics.py)")
+    parser.add_argument("--no-summaries", action="store_true",
+                        help="não mantém nem usa as tabelas de resumo das vendas")
+    parser.add_argument("--index-report", action="store_true",
+                        help="mede as consultas antes e depois da criação dos índices e sugere índices faltantes")
+    parser.add_argument("--date-from", type=date_argument, default=None,
+                        help="as questões só leem as notas a partir desta data (AAAA-MM-DD)")
+    parser.add_argument("--date-to", type=date_argument, default=None,
+                        help="as questões só leem as notas antes desta data (AAAA-MM-DD, exclusiva)")
+    parser.add_argument("--partition-months", type=int, default=None,
+                        help="particiona invoice e invoice_line por invoice_date, uma partição a cada N meses "
+                             "(na carga incremental vale o tamanho das partições existentes)")
+    parser.add_argument("--partition-ahead", type=int, default=3,
+                        help="partições vazias criadas depois da última data carregada")
+    parser.add_argument("--metrics-json", default=None,
+                        help="arquivo json com as medições (spans) de cada etapa, tabela, DDL e consulta")
+    parser.add_argument("--metrics-prom", default=None,
+                        help="arquivo .prom com as medições, no formato do textfile collector do Prometheus")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="mede o pico de memória alocada pelo Python em cada etapa (tracemalloc, mais lento)")
+    parser.add_argument("--profile", default=None, choices=["cprofile", "pyinstrument"],
+                        help="perfila o lado Python da execução e mostra as funções mais custosas")
+    parser.add_argument("--profile-output", default=None,
+                        help="arquivo do perfil (padrão: profile.prof no cProfile, profile.html no pyinstrument)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--incremental", action="store_true",
+                      help="não apaga as tabelas: pula os csv sem alteração e aplica os alterados como upsert")
+    mode.add_argument("--atomic", action="store_true",
+                      help="carrega em tabelas de staging e troca todas de uma vez (RENAME TABLE), sem indisponibilidade")
+    mode.add_argument("--rollback", action="store_true",
+                      help="volta as tabelas para a versão anterior à última carga --atomic")
+    mode.add_argument("--archive-before", type=date_argument, default=None,
+                      help="move as partições anteriores à data (AAAA-MM-DD) para tabelas __archive e as remove")
+    mode.add_argument("--drop-before", type=date_argument, default=None,
+                      help="remove as partições anteriores à data (AAAA-MM-DD), sem arquivar")
+    return(parser)
+# ---------------------------------------------------------------------------------------------------------------------
 
-    # Cria uma tabela para cada csv
-    for csv_path in csv_paths:
-        table_name = csv_path.split(".")[0]
-        df = pd.read_csv(os.path.join("dataset", csv_path))   
+# Função que executa a carga e as questões com os parâmetros lidos da linha de comando
+# Retorna as estatísticas da carga e os resultados das consultas
+def run_pipeline(parser, args):
+    dataset_cache = None if args.no_dataset_cache else (args.dataset_cache or os.path.join(args.dataset, ".cache"))
+    # O pool tem a conexão principal e, por carga em paralelo, a conexão da carga e a da engine (fallback pandas)
+    workers = max(1, min(args.workers, (pooling.CNX_POOL_MAXSIZE - 1) // 2))
+    date_range = None
+    if(args.date_from is not None or args.date_to is not None):
+        date_range = (args.date_from, args.date_to)
+
+    # Banco embarcado: carga completa e questões no próprio processo
+    if(args.backend != "mysql"):
+        if(args.incremental or args.atomic or args.rollback or args.index_report or args.cache_dir is not None):
+            parser.error("--incremental, --atomic, --rollback, --index-report e --cache-dir exigem --backend mysql")
+        if(args.partition_months is not None or args.archive_before is not None or args.drop_before is not None):
+            parser.error("--partition-months, --archive-before e --drop-before exigem --backend mysql")
+        if(args.strategy != "auto" and args.strategy not in backend_strategies[args.backend]):
+            parser.error("estratégias do backend {}: {}".format(args.backend,
+                                                                ", ".join(backend_strategies[args.backend])))
+        return(run_embedded(args.backend, args.database_file, args.strategy, args.chunk_size, workers,
+                            args.questions, args.fetch, dataset_cache, args.cross_check, args.dataset, date_range))
 
-        # Ajusta tipos específicos para datetime
-        if(csv_path == "employee.csv"):
-            df["hire_date"] = pd.to_datetime(df["hire_date"], infer_datetime_format=True)
-            df["birthdate"] = pd.to_datetime(df["birthdate"], infer_datetime_format=True)
-        if(csv_path == "invoice.csv"):
-            df["invoice_date"] = pd.to_datetime(df["invoice_date"], infer_datetime_format=True)
+    # Faz a conexão com o banco de dados
+    with span("phase", "connect"):
+        connection, engine, pool = connect_db(pool_size=2 * workers + 1, deadline=args.ready_timeout)
+
+    # Volta a versão anterior das tabelas (e força a próxima carga incremental a recarregá-las)
+    create_manifest(connection)
+    existing = existing_tables(connection)
+    if(args.rollback):
+        clear_manifest(connection, rollback_tables(connection, list(relationships), existing))
+        return([], [])
+
+    # Arquiva ou remove as partições antigas das tabelas fato (sem DELETE)
+    # Os resumos e as respostas do cache que leem essas tabelas deixam de valer
+    if(args.archive_before is not None or args.drop_before is not None):
+        with span("phase", "archive"):
+            removed = archive_partitions(connection, [table for table in partitioned_tables if table in existing],
+                                         args.archive_before or args.drop_before, args.archive_before is not None)
+        tables = sorted({table for table, name in removed})
+        reset_summaries(connection, tables)
+        cache = ResultCache(directory=args.cache_dir, max_bytes=args.cache_size * 1024 * 1024)
+        print("Partition: {} partições retiradas, {} respostas invalidadas".format(len(removed),
+                                                                                   cache.invalidate(tables)))
+        return([], [])
+
+    # Na carga completa, exclui as tabelas do banco, caso existam (e as retira do manifesto antes, para uma carga
+# interrompida no meio não deixar tabelas vazias registradas com o hash do csv)
+    # Na incremental, lê o manifesto da última carga
+    # Na atômica, as tabelas em uso continuam disponíveis e a carga vai para as tabelas de staging
+    manifest = None
+    suffix = ""
+    with span("phase", "drop"):
+        if(args.incremental):
+            manifest = read_manifest(connection)
+        elif(args.atomic):
+            suffix = staging_suffix
+            drop_all_tables(connection, relationships, suffix)
+        else:
+            clear_manifest(connection, list(relationships))
+            drop_all_tables(connection, relationships)
+
+    # Define a ordem das estratégias de carga
+    order = choose_strategies(connection, args.strategy)
+
+    # Monta a ordem de carga a partir das chaves estrangeiras
+    csv_tables = list_tables(args.dataset)
+    dependencies = table_dependencies(relationships)
+    for position, level in enumerate(dependency_levels({table: dependencies.get(table, set()) & set(csv_tables)
+                                                        for table in csv_tables})):
+        print("Nível {} da carga: {}".format(position + 1, ", ".join(level)))
+
+    # Cria e carrega as tabelas independentes em paralelo
+    with span("phase", "load"):
+        stats = run_in_order(csv_tables, dependencies,
+                             lambda table_name: load_csv_table(pool, engine, table_name, csv_tables[table_name],
+                                                               order, args.chunk_size, manifest, existing, suffix,
+                                                               dataset_cache, args.partition_months,
+                                                               args.partition_ahead),
+                             workers)
+
+    # Mostra a velocidade de carga de cada tabela
+    print_load_report(stats)
+
+    # As cargas foram gravadas por outras conexões do pool: encerra a transação aberta pela leitura do manifesto,
+    # para a validação e o relatório dos índices enxergarem os dados carregados (REPEATABLE READ)
+    connection.commit()
+
+    # Religa as chaves estrangeiras e valida as relações das tabelas que foram carregadas
+    # (na carga atômica, dados inválidos ficam no staging e as tabelas em uso não são trocadas)
+    loaded = [stat for stat in stats if stat["strategy"] != "skip"]
+    with span("phase", "validate"):
+        if(len(validate_relationships(connection, relationships, {stat["table"] for stat in loaded}, suffix)) > 0):
+            sys.exit(1)
+
+    # Cria os índices secundários depois da carga (na carga atômica, ainda nas tabelas de staging)
+    with span("phase", "indexes"):
+        if(args.index_report and not args.atomic):
+            index_report(connection, queries)
+        else:
+            create_indexes(connection, suffix)
+
+    # Troca as tabelas de staging pelas tabelas em uso de uma só vez
+    if(args.atomic):
+        with span("phase", "swap"):
+            swap_tables(connection, [table for table in relationships if table in csv_tables], existing)
+
+    # Registra os csv carregados no manifesto
+    for stat in loaded:
+        update_manifest(connection, stat["table"], stat["file_hash"], stat["rows"])
+
+    # Atualiza as tabelas de resumo (só as linhas novas, quando possível)
+    if(not args.no_summaries):
+        with span("phase", "summaries"):
+            update_summaries(connection, stats)
+
+    # Descarta do cache as respostas que leem as tabelas recarregadas
+    cache = ResultCache(directory=args.cache_dir, max_bytes=args.cache_size * 1024 * 1024)
+    print("Cache: {} respostas invalidadas".format(cache.invalidate([stat["table"] for stat in loaded])))
 
-        # Cria a tabela
-        df.to_sql(table_name, con=engine, if_exists='replace', index=False)
+    # Resolve as questões mencionadas no readme.md
+    with span("phase", "questions"):
+        results = solve_questions(pool, args.questions, workers, args.fetch, cache, not args.no_summaries,
+                                  date_range)
+
+    # Confere as respostas do SQL com as do motor em memória
+    if(args.cross_check):
+        with span("phase", "cross_check"):
+            cross_check(pool, load_frames(args.dataset, dataset_cache), args.questions, workers, not args.no_summaries,
+                        date_range)
+    return(stats, results)
+# ---------------------------------------------------------------------------------------------------------------------
 
-    # Cria as relações entre as tabelas
-    create_relationships(connection, relationships)
+# Função que executa a carga e as questões com os parâmetros da linha de comando (ou da lista informada)
+# As medições (spans) são mostradas ao final e gravadas em json / Prometheus, se pedido
+# Retorna o relatório da execução: tempo de cada etapa, estatísticas da carga, resultados das consultas e spans
+def main(argv=None):
+    parser = argument_parser()
+    args = parser.parse_args(argv)
+
+    metrics.reset(args.trace_memory, args.profile)
+    with metrics.profile(args.profile_output):
+        stats, results = run_pipeline(parser, args)
+
+    print_metrics_report()
+    if(args.metrics_json is not None):
+        metrics.write_json(args.metrics_json)
+    if(args.metrics_prom is not None):
+        metrics.write_prometheus(args.metrics_prom)
+    return({"phases": metrics.phase_seconds(), "load": stats, "queries": results, "metrics": metrics.report()})
+# ---------------------------------------------------------------------------------------------------------------------
 
-    # Resolve as questões mencionadas no readme.md
-    solve_questions(connection)
-# ---------------------------------------------------------------------------------------------------------------------
\ No newline at end of file
+if __name__ == "__main__": 
+    main()
+# ---------------------------------------------------------------------------------------------------------------------
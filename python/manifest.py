@@ -0,0 +1,62 @@
+# ---------------------------------------------------------------------------------------------------------------------
+# Manifesto da carga: hash e número de linhas de cada csv carregado (usado na carga incremental)
+# Glenda Proença Train
+# ---------------------------------------------------------------------------------------------------------------------
+import hashlib
+from metrics import execute_ddl
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Nome da tabela de metadados que guarda o manifesto
+manifest_table = "load_manifest"
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que calcula o hash (sha256) do conteúdo de um arquivo, lendo em blocos
+def file_hash(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return(digest.hexdigest())
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que cria a tabela do manifesto, caso ainda não exista
+def create_manifest(connection):
+    with connection.cursor() as cursor:
+        execute_ddl(cursor, "CREATE TABLE IF NOT EXISTS {} ( \
+                            table_name VARCHAR(64) NOT NULL, \
+                            file_hash CHAR(64) NOT NULL, \
+                            row_count INT NOT NULL, \
+                            loaded_at DATETIME NOT NULL, \
+                            PRIMARY KEY (table_name) \
+                        ) ENGINE=InnoDB".format(manifest_table))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que lê o manifesto da última carga
+# Retorna {tabela: (hash do csv, número de linhas)}
+def read_manifest(connection):
+    with connection.cursor(buffered=True) as cursor:
+        cursor.execute("SELECT table_name, file_hash, row_count FROM {}".format(manifest_table))
+        return({row[0]: (row[1], row[2]) for row in cursor.fetchall()})
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que remove tabelas do manifesto (a próxima carga incremental recarrega essas tabelas)
+def clear_manifest(connection, tables):
+    if(len(tables) == 0):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM {} WHERE table_name IN ({})".format(manifest_table, ", ".join(["%s"] * len(tables))),
+                       tuple(tables))
+    connection.commit()
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que registra no manifesto o csv que acabou de ser carregado
+def update_manifest(connection, table, digest, rows):
+    with connection.cursor() as cursor:
+        cursor.execute("INSERT INTO {} (table_name, file_hash, row_count, loaded_at) \
+                        VALUES (%s, %s, %s, NOW()) \
+                        ON DUPLICATE KEY UPDATE file_hash = VALUES(file_hash), \
+                                                row_count = VALUES(row_count), \
+                                                loaded_at = VALUES(loaded_at)".format(manifest_table),
+                       (table, digest, rows))
+    connection.commit()
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,235 @@
+# ---------------------------------------------------------------------------------------------------------------------
+# Tabelas de resumo (agregados de vendas) mantidas de forma incremental a cada carga
+# Glenda Proença Train
+# ---------------------------------------------------------------------------------------------------------------------
+import json
+from manifest import read_manifest
+from metrics import execute_ddl
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Nome da tabela que guarda o estado de cada resumo (marca d'água, linhas da tabela fato até a marca
+# e versão das tabelas lidas)
+summary_state_table = "summary_state"
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Define as tabelas de resumo
+# tables: tabelas lidas pelo resumo
+# source: [tabela fato, coluna crescente] usada como marca d'água da atualização incremental
+# key / columns: chave primária e demais colunas [nome, tipo]
+# sum: colunas somadas quando o mesmo grupo recebe linhas novas
+# select: agregação das linhas da tabela fato entre as marcas d'água %(low)s e %(high)s
+summaries = {
+    "sales_by_genre_country": {
+        "tables": ["invoice_line", "invoice", "customer", "track", "genre"],
+        "source": ["invoice_line", "invoice_line_id"],
+        "key": [["country", "VARCHAR(64) NOT NULL"], ["genre_id", "INT NOT NULL"]],
+        "columns": [["genre_name", "VARCHAR(128)"], ["purchases", "INT NOT NULL"], ["quantity", "INT NOT NULL"],
+                    ["invoice_total", "DOUBLE NOT NULL"]],
+        "sum": ["purchases", "quantity", "invoice_total"],
+        "select": "SELECT customer.country AS country, genre.genre_id AS genre_id, genre.genre_name AS genre_name, \
+                   COUNT(invoice_line.quantity) AS purchases, SUM(invoice_line.quantity) AS quantity, \
+                   SUM(invoice.total) AS invoice_total \
+                   FROM invoice_line \
+                   INNER JOIN invoice ON invoice.invoice_id = invoice_line.invoice_id \
+                   INNER JOIN customer ON customer.customer_id = invoice.customer_id \
+                   INNER JOIN track ON track.track_id = invoice_line.track_id \
+                   INNER JOIN genre ON genre.genre_id = track.genre_id \
+                   WHERE invoice_line.invoice_line_id > %(low)s AND invoice_line.invoice_line_id <= %(high)s \
+                   GROUP BY customer.country, genre.genre_id, genre.genre_name"
+    },
+
+    "sales_by_customer_artist": {
+        "tables": ["invoice_line", "invoice", "customer", "track", "album", "artist"],
+        "source": ["invoice_line", "invoice_line_id"],
+        "key": [["customer_id", "INT NOT NULL"], ["artist_id", "INT NOT NULL"]],
+        "columns": [["first_name", "VARCHAR(64)"], ["artist_name", "VARCHAR(256)"], ["purchases", "INT NOT NULL"],
+                    ["quantity", "INT NOT NULL"], ["total_spent", "DOUBLE NOT NULL"]],
+        "sum": ["purchases", "quantity", "total_spent"],
+        "select": "SELECT customer.customer_id AS customer_id, artist.artist_id AS artist_id, \
+                   customer.first_name AS first_name, artist.artist_name AS artist_name, \
+                   COUNT(invoice_line.quantity) AS purchases, SUM(invoice_line.quantity) AS quantity, \
+                   SUM(invoice_line.unit_price * invoice_line.quantity) AS total_spent \
+                   FROM invoice_line \
+                   INNER JOIN invoice ON invoice.invoice_id = invoice_line.invoice_id \
+                   INNER JOIN customer ON customer.customer_id = invoice.customer_id \
+                   INNER JOIN track ON track.track_id = invoice_line.track_id \
+                   INNER JOIN album ON album.album_id = track.album_id \
+                   INNER JOIN artist ON artist.artist_id = album.artist_id \
+                   WHERE invoice_line.invoice_line_id > %(low)s AND invoice_line.invoice_line_id <= %(high)s \
+                   GROUP BY customer.customer_id, artist.artist_id, customer.first_name, artist.artist_name"
+    },
+
+    "sales_by_track": {
+        "tables": ["invoice_line", "track"],
+        "source": ["invoice_line", "invoice_line_id"],
+        "key": [["track_id", "INT NOT NULL"]],
+        "columns": [["track_name", "VARCHAR(256)"], ["purchases", "INT NOT NULL"], ["quantity", "INT NOT NULL"]],
+        "sum": ["purchases", "quantity"],
+        "select": "SELECT track.track_id AS track_id, track.track_name AS track_name, \
+                   COUNT(invoice_line.quantity) AS purchases, SUM(invoice_line.quantity) AS quantity \
+                   FROM invoice_line \
+                   INNER JOIN track ON track.track_id = invoice_line.track_id \
+                   WHERE invoice_line.invoice_line_id > %(low)s AND invoice_line.invoice_line_id <= %(high)s \
+                   GROUP BY track.track_id, track.track_name"
+    },
+
+    "sales_by_city": {
+        "tables": ["invoice"],
+        "source": ["invoice", "invoice_id"],
+        "key": [["billing_city", "VARCHAR(64) NOT NULL"]],
+        "columns": [["invoice_count", "INT NOT NULL"], ["total", "DOUBLE NOT NULL"]],
+        "sum": ["invoice_count", "total"],
+        "select": "SELECT billing_city, COUNT(invoice_id) AS invoice_count, SUM(total) AS total \
+                   FROM invoice \
+                   WHERE invoice_id > %(low)s AND invoice_id <= %(high)s \
+                   GROUP BY billing_city"
+    },
+
+    "sales_by_customer_country": {
+        "tables": ["invoice", "customer"],
+        "source": ["invoice", "invoice_id"],
+        "key": [["customer_id", "INT NOT NULL"], ["billing_country", "VARCHAR(64) NOT NULL"]],
+        "columns": [["first_name", "VARCHAR(64)"], ["last_name", "VARCHAR(64)"], ["invoice_count", "INT NOT NULL"],
+                    ["total", "DOUBLE NOT NULL"]],
+        "sum": ["invoice_count", "total"],
+        "select": "SELECT customer.customer_id AS customer_id, invoice.billing_country AS billing_country, \
+                   customer.first_name AS first_name, customer.last_name AS last_name, \
+                   COUNT(invoice.invoice_id) AS invoice_count, SUM(invoice.total) AS total \
+                   FROM invoice \
+                   INNER JOIN customer ON customer.customer_id = invoice.customer_id \
+                   WHERE invoice.invoice_id > %(low)s AND invoice.invoice_id <= %(high)s \
+                   GROUP BY customer.customer_id, invoice.billing_country, customer.first_name, customer.last_name"
+    }
+}
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que cria a tabela de estado dos resumos, caso ainda não exista
+def create_summary_state(connection):
+    with connection.cursor() as cursor:
+        execute_ddl(cursor, "CREATE TABLE IF NOT EXISTS {} ( \
+                            summary_name VARCHAR(64) NOT NULL, \
+                            watermark BIGINT NOT NULL, \
+                            source_rows BIGINT NULL, \
+                            versions TEXT NOT NULL, \
+                            refreshed_at DATETIME NOT NULL, \
+                            PRIMARY KEY (summary_name) \
+                        ) ENGINE=InnoDB".format(summary_state_table))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que lê o estado dos resumos: {resumo: (marca d'água, versões das tabelas lidas, linhas até a marca)}
+def read_summary_state(connection):
+    with connection.cursor(buffered=True) as cursor:
+        cursor.execute("SELECT summary_name, watermark, versions, source_rows FROM {}".format(summary_state_table))
+        return({row[0]: (row[1], json.loads(row[2]), row[3]) for row in cursor.fetchall()})
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que retorna a versão atual (hash no manifesto da carga) das tabelas lidas por um resumo
+def summary_versions(summary, manifest):
+    return({table: manifest.get(table, (None, None))[0] for table in summaries[summary]["tables"]})
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que descobre os resumos atualizados: as tabelas lidas estão na mesma versão da última atualização
+def fresh_summaries(connection):
+    create_summary_state(connection)
+    manifest = read_manifest(connection)
+    state = read_summary_state(connection)
+    return({summary for summary in summaries
+            if summary in state and state[summary][1] == summary_versions(summary, manifest)})
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que conta as linhas da tabela fato até a marca d'água
+# Se o número mudou desde a última atualização, entraram linhas abaixo da marca (ex.: uma linha removida
+# e depois restaurada, ou um buraco de ids preenchido), que a atualização incremental não veria
+def source_rows(connection, summary, watermark):
+    table, column = summaries[summary]["source"]
+    with connection.cursor(buffered=True) as cursor:
+        cursor.execute("SELECT COUNT(*) FROM {} WHERE {} <= %s".format(table, column), (watermark,))
+        return(cursor.fetchone()[0])
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que soma ao resumo as linhas da tabela fato acima da marca d'água
+# Os grupos que já existem são somados (ON DUPLICATE KEY UPDATE), os novos são inseridos
+# Retorna [nova marca d'água, linhas da tabela fato até ela]
+def refresh_summary(connection, summary, low):
+    definition = summaries[summary]
+    table, column = definition["source"]
+    columns = [item[0] for item in definition["key"] + definition["columns"]]
+    updates = ", ".join("{0} = {1}.{0} + delta.{0}".format(name, summary) if name in definition["sum"]
+                        else "{0} = delta.{0}".format(name)
+                        for name in columns if name not in [item[0] for item in definition["key"]])
+
+    with connection.cursor(buffered=True) as cursor:
+        # A marca d'água final é lida antes, para linhas inseridas durante a atualização ficarem para a próxima
+        cursor.execute("SELECT COALESCE(MAX({}), 0), COUNT(*) FROM {}".format(column, table))
+        high, rows = cursor.fetchone()
+
+        cursor.execute("INSERT INTO {0} ({1}) SELECT * FROM ({2}) AS delta \
+                        ON DUPLICATE KEY UPDATE {3}".format(summary, ", ".join(columns), definition["select"], updates),
+                       {"low": low, "high": high})
+    return([high, rows])
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que recria o resumo do zero (usada na primeira vez ou quando linhas antigas mudaram)
+def rebuild_summary(connection, summary):
+    definition = summaries[summary]
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM {} WHERE summary_name = %s".format(summary_state_table), (summary,))
+        execute_ddl(cursor, "DROP TABLE IF EXISTS {}".format(summary))
+        execute_ddl(cursor, "CREATE TABLE {} ({}, PRIMARY KEY ({})) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4".format(
+            summary,
+            ", ".join("{} {}".format(name, column_type) for name, column_type in definition["key"] + definition["columns"]),
+            ", ".join(item[0] for item in definition["key"])))
+    connection.commit()
+    return(refresh_summary(connection, summary, 0))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que descarta o estado dos resumos que leem as tabelas informadas, alteradas fora da carga
+# (ex.: partições arquivadas): as consultas deixam de usar esses resumos e a próxima carga os recria
+def reset_summaries(connection, tables):
+    create_summary_state(connection)
+    stale = [summary for summary, definition in summaries.items() if len(set(definition["tables"]) & set(tables)) > 0]
+    with connection.cursor() as cursor:
+        for summary in stale:
+            cursor.execute("DELETE FROM {} WHERE summary_name = %s".format(summary_state_table), (summary,))
+    connection.commit()
+    return(stale)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que mantém os resumos depois de uma carga
+# Se as tabelas lidas pelo resumo só receberam linhas novas, todas acima da marca d'água (as linhas da tabela
+# fato até a marca continuam as mesmas), soma apenas as linhas novas da tabela fato;
+# se alguma foi recarregada por inteiro ou teve linhas antigas alteradas/removidas/restauradas, recria o resumo
+# Uma tabela recarregada por inteiro sempre recria o resumo, mesmo com o csv igual: o conteúdo anterior pode
+# ter sido outro (ex.: partições arquivadas que a carga completa devolveu)
+def update_summaries(connection, stats):
+    create_summary_state(connection)
+    manifest = read_manifest(connection)
+    state = read_summary_state(connection)
+    loaded = {stat["table"]: stat for stat in stats if stat["strategy"] != "skip"}
+
+    for summary, definition in summaries.items():
+        versions = summary_versions(summary, manifest)
+        reloaded = any(loaded[table]["strategy"] != "upsert" for table in definition["tables"] if table in loaded)
+        if(summary in state and state[summary][1] == versions and not reloaded):
+            continue
+
+        append_only = all(loaded[table]["strategy"] == "upsert" and loaded[table].get("changed_rows", 1) == 0
+                          for table in definition["tables"] if table in loaded)
+        if(summary in state and append_only and state[summary][2] is not None and
+           source_rows(connection, summary, state[summary][0]) == state[summary][2]):
+            print("Summary: atualizando {} a partir da marca {}".format(summary, state[summary][0]))
+            watermark, rows = refresh_summary(connection, summary, state[summary][0])
+        else:
+            print("Summary: recriando {}".format(summary))
+            watermark, rows = rebuild_summary(connection, summary)
+
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO {} (summary_name, watermark, source_rows, versions, refreshed_at) \
+                            VALUES (%s, %s, %s, %s, NOW()) \
+                            ON DUPLICATE KEY UPDATE watermark = VALUES(watermark), \
+                                                    source_rows = VALUES(source_rows), \
+                                                    versions = VALUES(versions), \
+                                                    refreshed_at = VALUES(refreshed_at)".format(summary_state_table),
+                           (summary, watermark, rows, json.dumps(versions, sort_keys=True)))
+        connection.commit()
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,311 @@
+# ---------------------------------------------------------------------------------------------------------------------
+# Medições da execução: etapas (spans) com tempo, linhas, bytes e pico de memória, exportadas em json e Prometheus
+# Glenda Proença Train
+# ---------------------------------------------------------------------------------------------------------------------
+import os
+import re
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from datetime import datetime
+from contextlib import contextmanager
+
+# O módulo resource só existe em sistemas Unix: sem ele, o pico de RSS não é medido
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# O pyinstrument é opcional (pip install pyinstrument), só é necessário com --profile pyinstrument
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Prefixo das métricas no arquivo do Prometheus
+prometheus_prefix = "sqlproject"
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Define as medidas exportadas de cada span: [campo do span, nome da métrica, descrição, agregação]
+# Spans com o mesmo tipo e nome (ex.: dois DROP da mesma tabela) são somados, e os picos de memória, o maior
+measures = [
+    ["seconds", "span_seconds", "Duração do span, em segundos", sum],
+    ["rows", "span_rows", "Linhas lidas ou gravadas no span", sum],
+    ["bytes", "span_bytes", "Bytes lidos ou gravados no span", sum],
+    ["rss_delta_bytes", "span_rss_delta_bytes", "Variação da memória residente do processo durante o span", sum],
+    ["rss_peak_bytes", "span_rss_peak_bytes", "Pico de memória residente durante a etapa (só etapas, Linux)", max],
+    ["python_peak_bytes", "span_python_peak_bytes", "Pico de memória alocada pelo Python na etapa (--trace-memory)",
+     max]
+]
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que lê o pico de memória residente (RSS) do processo desde o início, em bytes
+def peak_rss():
+    if(resource is None):
+        return(None)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # O Linux informa em KB e o macOS em bytes
+    return(peak if sys.platform == "darwin" else peak * 1024)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que lê a memória residente atual (VmRSS) e o pico desde a última reinicialização (VmHWM), em bytes
+# Retorna None fora do Linux
+def memory_status():
+    try:
+        with open("/proc/self/status") as f:
+            status = {line.split(":")[0]: int(line.split()[1]) * 1024 for line in f
+                      if line.startswith(("VmRSS:", "VmHWM:"))}
+    except OSError:
+        return(None)
+    return(status if len(status) == 2 else None)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que reinicia o pico de memória residente do processo (VmHWM), para medir o pico de uma etapa
+# Retorna False se o sistema não permitir (fora do Linux ou sem acesso ao /proc/self/clear_refs)
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return(False)
+    return(True)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Coletor das medições de uma execução
+# Cada span tem tipo (phase, parse, insert, ddl, query), nome (etapa, tabela ou consulta) e as medidas
+# As etapas (phase) são sequenciais e reiniciam os picos de memória (VmHWM no Linux e tracemalloc), então
+# cada etapa registra o seu próprio pico; os spans dentro de uma etapa (ex.: cargas em paralelo) registram a
+# variação do RSS do processo durante o span (com spans em paralelo, inclui a memória dos vizinhos) e o pico
+# do tracemalloc da etapa até o seu fim
+class Metrics:
+
+    def __init__(self):
+        self.reset()
+
+    # Começa uma nova execução (descarta os spans anteriores)
+    def reset(self, trace_memory=False, profiler=None):
+        self.started = time.perf_counter()
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self.spans = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.profiler = profiler
+        self.profiles = []
+        self.rss_peak = peak_rss()
+        if(trace_memory and not tracemalloc.is_tracing()):
+            tracemalloc.start()
+        elif(not trace_memory and tracemalloc.is_tracing()):
+            tracemalloc.stop()
+
+    # Mede o bloco: o dicionário retornado recebe as linhas e os bytes (ex.: span["rows"] = len(df))
+    @contextmanager
+    def span(self, kind, name, **labels):
+        record = {"kind": kind, "name": name, "rows": None, "bytes": None}
+        record.update(labels)
+        peak_reset = False
+        if(kind == "phase"):
+            self.update_rss_peak()
+            peak_reset = reset_peak_rss()
+            if(tracemalloc.is_tracing()):
+                tracemalloc.reset_peak()
+        memory = memory_status()
+        profile = self.start_thread_profile()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["start"] = start - self.started
+            record["seconds"] = time.perf_counter() - start
+            end_memory = memory_status()
+            record["rss_delta_bytes"] = None if memory is None or end_memory is None else \
+                end_memory["VmRSS"] - memory["VmRSS"]
+            record["rss_peak_bytes"] = end_memory["VmHWM"] if peak_reset and end_memory is not None else None
+            record["python_peak_bytes"] = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None
+            if(kind == "phase"):
+                self.update_rss_peak()
+            self.stop_thread_profile(profile)
+            with self.lock:
+                self.spans.append(record)
+
+    # Guarda o maior pico de RSS visto na execução (o VmHWM é reiniciado a cada etapa, e o ru_maxrss do Linux
+    # acompanha o VmHWM)
+    def update_rss_peak(self):
+        memory = memory_status()
+        peaks = [peak for peak in [self.rss_peak, peak_rss(), None if memory is None else memory["VmHWM"]]
+                 if peak is not None]
+        self.rss_peak = max(peaks) if len(peaks) > 0 else None
+        return(self.rss_peak)
+
+    # Com o cProfile, cada thread da carga e das consultas tem o seu perfil (o cProfile só vê a própria thread),
+    # somado ao da thread principal no final
+    def start_thread_profile(self):
+        if(self.profiler != "cprofile" or getattr(self.local, "profile", None) is not None):
+            return(None)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # A partir do Python 3.12 só um perfil fica ativo por vez: a thread fica sem perfil
+            return(None)
+        self.local.profile = profile
+        return(profile)
+
+    def stop_thread_profile(self, profile):
+        if(profile is None):
+            return
+        profile.disable()
+        self.local.profile = None
+        with self.lock:
+            self.profiles.append(profile)
+
+    # Perfila a execução inteira com o cProfile ou o pyinstrument (o pyinstrument só amostra a thread principal)
+    # O perfil é gravado em output e as funções mais custosas são mostradas
+    @contextmanager
+    def profile(self, output=None):
+        if(self.profiler is None):
+            yield
+        elif(self.profiler == "pyinstrument"):
+            if(Profiler is None):
+                raise ImportError("O --profile pyinstrument precisa do pacote pyinstrument (pip install pyinstrument)")
+            profiler = Profiler()
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                with open(output or "profile.html", "w") as f:
+                    f.write(profiler.output_html())
+                print(profiler.output_text(unicode=True))
+                print("Profile: gravado em {}".format(output or "profile.html"))
+        else:
+            profile = self.start_thread_profile()
+            try:
+                yield
+            finally:
+                self.stop_thread_profile(profile)
+                stats = pstats.Stats(*self.profiles)
+                stats.dump_stats(output or "profile.prof")
+                stats.sort_stats("cumulative").print_stats(25)
+                print("Profile: gravado em {} (python -m pstats {})".format(output or "profile.prof",
+                                                                            output or "profile.prof"))
+
+    # Tempo de cada etapa: {etapa: segundos}
+    def phase_seconds(self):
+        return({span["name"]: span["seconds"] for span in self.spans if span["kind"] == "phase"})
+
+    # Relatório da execução: spans em ordem de início e totais por tipo de span
+    def report(self):
+        spans = sorted(self.spans, key=lambda span: span["start"])
+        totals = {}
+        for span in spans:
+            total = totals.setdefault(span["kind"], {"count": 0, "seconds": 0, "rows": 0, "bytes": 0})
+            total["count"] += 1
+            for measure in ["seconds", "rows", "bytes"]:
+                total[measure] += span[measure] or 0
+        return({"started_at": self.started_at,
+                "wall_seconds": time.perf_counter() - self.started,
+                "rss_peak_bytes": self.update_rss_peak(),
+                "totals": totals,
+                "spans": spans})
+
+    # Grava o relatório em json
+    def write_json(self, path):
+        write_atomic(path, json.dumps(self.report(), indent=2, default=str))
+
+    # Grava as medidas no formato texto do Prometheus (para o textfile collector do node_exporter)
+    def write_prometheus(self, path):
+        groups = {}
+        for span in self.spans:
+            labels = [["kind", span["kind"]], ["name", span["name"]]]
+            if(span.get("statement") is not None):
+                labels.append(["statement", span["statement"]])
+            groups.setdefault(tuple(tuple(label) for label in labels), []).append(span)
+
+        lines = []
+        for field, metric, description, aggregate in measures:
+            values = [(labels, aggregate(span[field] for span in spans)) for labels, spans in groups.items()
+                      if all(span[field] is not None for span in spans)]
+            if(len(values) == 0):
+                continue
+            lines.append("# HELP {}_{} {}".format(prometheus_prefix, metric, description))
+            lines.append("# TYPE {}_{} gauge".format(prometheus_prefix, metric))
+            for labels, value in values:
+                lines.append("{}_{}{{{}}} {}".format(prometheus_prefix, metric,
+                                                      ",".join('{}="{}"'.format(key, prometheus_label(label))
+                                                               for key, label in labels), value))
+
+        report = self.report()
+        for metric, description, value in [["run_wall_seconds", "Duração total da execução", report["wall_seconds"]],
+                                           ["run_rss_peak_bytes", "Pico de memória residente do processo",
+                                            report["rss_peak_bytes"]],
+                                           ["run_timestamp_seconds", "Fim da execução (Unix time)", time.time()]]:
+            if(value is not None):
+                lines.append("# HELP {}_{} {}".format(prometheus_prefix, metric, description))
+                lines.append("# TYPE {}_{} gauge".format(prometheus_prefix, metric))
+                lines.append("{}_{} {}".format(prometheus_prefix, metric, value))
+        write_atomic(path, "\n".join(lines) + "\n")
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que escapa um valor de label do Prometheus (barra invertida, aspas e quebra de linha)
+def prometheus_label(value):
+    return(str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que grava o arquivo de uma vez (temporário + troca), para um leitor nunca ver o arquivo pela metade
+def write_atomic(path, content):
+    directory = os.path.dirname(path)
+    if(directory != ""):
+        os.makedirs(directory, exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(path + ".tmp", path)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Coletor usado pelos módulos da carga e das consultas (reiniciado a cada execução do insert_data.main)
+metrics = Metrics()
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que mede um bloco no coletor da execução (ver Metrics.span)
+def span(kind, name, **labels):
+    return(metrics.span(kind, name, **labels))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Reconhece o comando e o objeto de um DDL (ex.: ALTER TABLE track, CREATE INDEX IF NOT EXISTS ix_track_genre)
+ddl_pattern = re.compile(r"^\s*(CREATE|ALTER|DROP|RENAME)\s+(?:TEMPORARY\s+)?(TABLE|INDEX)\s+"
+                         r"(?:IF\s+(?:NOT\s+)?EXISTS\s+)?(\w+)", re.IGNORECASE)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que executa um comando DDL medindo o seu tempo (um span ddl por comando)
+def execute_ddl(cursor, sql, params=None):
+    match = ddl_pattern.match(sql)
+    if(match is None):
+        statement, name = sql.split()[0].upper(), ""
+    else:
+        statement, name = "{} {}".format(match.group(1), match.group(2)).upper(), match.group(3)
+    with span("ddl", name, statement=statement):
+        if(params is None):
+            cursor.execute(sql)
+        else:
+            cursor.execute(sql, params)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que mostra os totais por tipo de span e os spans mais demorados
+def print_metrics_report(top=10):
+    report = metrics.report()
+    rss = "" if report["rss_peak_bytes"] is None else ", pico de RSS {:.1f} MB".format(report["rss_peak_bytes"] / 2 ** 20)
+    print("\nMétricas (tempo total {:.2f} s{}):".format(report["wall_seconds"], rss))
+    print("   {:<8} {:>6} {:>12} {:>12} {:>14}".format("Tipo", "Spans", "Tempo(s)", "Linhas", "Bytes"))
+    for kind, total in report["totals"].items():
+        print("   {:<8} {:>6} {:>12.3f} {:>12} {:>14}".format(kind, total["count"], total["seconds"], total["rows"],
+                                                             total["bytes"]))
+    print("   Mais demorados (sem as etapas):")
+    for item in sorted([item for item in report["spans"] if item["kind"] != "phase"],
+                       key=lambda item: -item["seconds"])[:top]:
+        label = (item.get("statement", "") + " " + item["name"]).strip()
+        print("   {:<8} {:<40} {:>10.3f} s".format(item["kind"], label, item["seconds"]))
+# ---------------------------------------------------------------------------------------------------------------------
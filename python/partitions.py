@@ -0,0 +1,210 @@
+# ---------------------------------------------------------------------------------------------------------------------
+# Particionamento das tabelas fato por faixa de data (invoice e invoice_line por invoice_date)
+# Glenda Proença Train
+# ---------------------------------------------------------------------------------------------------------------------
+import os
+import re
+import pandas as pd
+from dataset import list_tables, read_table
+from metrics import execute_ddl
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Define as tabelas particionadas (RANGE COLUMNS) e a coluna de data de cada uma
+# source: [tabela, chave] de onde a coluna é copiada quando não está no csv (invoice_line recebe a data da nota,
+# para as duas tabelas terem as mesmas partições e as consultas por período lerem só as partições do período)
+# O MySQL não aceita chaves estrangeiras em tabelas particionadas nem chave primária sem a coluna da partição:
+# as relações dessas tabelas passam a ser só validadas depois da carga (linhas órfãs) e a chave primária
+# vira (id, data)
+partitioned_tables = {
+    "invoice": {"column": "invoice_date", "source": None},
+
+    "invoice_line": {"column": "invoice_date", "source": ["invoice", "invoice_id"]}
+}
+
+# Partição que recebe as datas depois da última faixa criada (mantida vazia, para a divisão ser imediata)
+max_partition = "pmax"
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que retorna o início do período (de months meses, contados a partir de janeiro) que contém a data
+def period_start(date, months=1):
+    return(pd.Timestamp(date.year, (date.month - 1) // months * months + 1, 1))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que calcula os limites superiores das partições, do período de first ao período de last
+# mais ahead períodos vazios (a carga seguinte já encontra as partições criadas)
+def partition_bounds(first, last, months=1, ahead=3):
+    bounds = []
+    bound = period_start(first, months)
+    while(bound <= last or len(bounds) == 0):
+        bound = bound + pd.DateOffset(months=months)
+        bounds.append(bound)
+    for _ in range(ahead):
+        bounds.append(bounds[-1] + pd.DateOffset(months=months))
+    return(bounds)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que monta a definição de cada partição (o nome é o início do período, ex.: p201701)
+def partition_definitions(bounds, months=1):
+    definitions = []
+    for bound in bounds:
+        definitions.append("PARTITION p{:%Y%m} VALUES LESS THAN ('{:%Y-%m-%d %H:%M:%S}')".format(
+            bound - pd.DateOffset(months=months), bound))
+    return(definitions + ["PARTITION {} VALUES LESS THAN (MAXVALUE)".format(max_partition)])
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que monta o particionamento usado no CREATE TABLE a partir das datas carregadas
+# Retorna [coluna da partição, cláusula PARTITION BY]
+def partition_spec(table, df, months=1, ahead=3):
+    column = partitioned_tables[table]["column"]
+    bounds = partition_bounds(df[column].min(), df[column].max(), months, ahead)
+    definitions = partition_definitions(bounds, months)
+    return([column, "PARTITION BY RANGE COLUMNS({}) (\n    {}\n)".format(column, ",\n    ".join(definitions))])
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que copia a coluna da partição da tabela de origem, quando ela não está no csv
+# (ex.: invoice_line.invoice_date = invoice.invoice_date, pela invoice_id); o csv de origem fica na mesma pasta
+def add_partition_column(table, df, csv_path, cache_dir=None):
+    column = partitioned_tables[table]["column"]
+    if(partitioned_tables[table]["source"] is None or column in df.columns):
+        return(df)
+
+    source_table, key = partitioned_tables[table]["source"]
+    source = read_table(source_table, list_tables(os.path.dirname(csv_path) or ".")[source_table], cache_dir)
+    df = df.copy()
+    df[column] = df[key].map(pd.Series(source[column].to_numpy(), index=source[key].to_numpy()))
+    return(df)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que lê as partições da tabela: [(nome, limite superior)], com o limite None na partição MAXVALUE
+# Retorna uma lista vazia se a tabela não for particionada
+def table_partitions(connection, table):
+    with connection.cursor(buffered=True) as cursor:
+        cursor.execute("SELECT PARTITION_NAME, PARTITION_DESCRIPTION \
+                        FROM information_schema.PARTITIONS \
+                        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL \
+                        ORDER BY PARTITION_ORDINAL_POSITION", (table,))
+        return([(name, None if description == "MAXVALUE" else pd.Timestamp(description.strip("'")))
+                for name, description in cursor.fetchall()])
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que lê a faixa da tabela particionada a partir da sua primeira partição (o nome é o início do período)
+# Retorna [início da primeira partição, meses de cada partição], ou None se a tabela não for particionada
+# O início da primeira partição é o limite das datas guardadas: o que é anterior foi arquivado ou removido
+def partition_layout(partitions):
+    if(len(partitions) == 0 or partitions[0][1] is None):
+        return(None)
+    name, bound = partitions[0]
+    start = pd.to_datetime(name[1:], format="%Y%m")
+    return([start, (bound.year - start.year) * 12 + bound.month - start.month])
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que retira do csv as linhas anteriores à primeira partição (arquivadas ou removidas com --archive-before
+# ou --drop-before), para a carga incremental seguinte não devolvê-las à tabela
+def skip_archived(table, df, partitions):
+    layout = partition_layout(partitions)
+    if(layout is None):
+        return(df)
+    archived = df[partitioned_tables[table]["column"]] < layout[0]
+    if(archived.any()):
+        print("Partition: {} linhas de {} anteriores a {:%Y-%m-%d} ignoradas (já arquivadas)".format(
+            int(archived.sum()), table, layout[0]))
+    return(df[~archived])
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que cria as partições que faltam até o período de last mais ahead períodos vazios
+# As novas partições seguem o tamanho das partições que a tabela já tem
+# A partição MAXVALUE é dividida (REORGANIZE PARTITION); como ela fica vazia, a divisão não move linhas
+# Retorna o número de partições criadas
+def roll_partitions(connection, table, last, ahead=3):
+    partitions = table_partitions(connection, table)
+    bounds = [bound for name, bound in partitions if bound is not None]
+    if(len(bounds) == 0):
+        return(0)
+
+    months = partition_layout(partitions)[1]
+    wanted = partition_bounds(last, last, months, ahead)[-1]
+    new = []
+    while(bounds[-1] < wanted):
+        bounds.append(bounds[-1] + pd.DateOffset(months=months))
+        new.append(bounds[-1])
+    if(len(new) == 0):
+        return(0)
+
+    print("Partition: criando {} partições em {} (até {:%Y-%m-%d})".format(len(new), table, new[-1]))
+    with connection.cursor() as cursor:
+        execute_ddl(cursor, "ALTER TABLE {} REORGANIZE PARTITION {} INTO ({})".format(
+            table, max_partition, ", ".join(partition_definitions(new, months))))
+    return(len(new))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que retira da tabela as partições inteiramente anteriores a before, sem DELETE
+# Com archive, cada partição é trocada (EXCHANGE PARTITION) por uma tabela <tabela>__archive_<partição> vazia,
+# que fica com as linhas; a partição vazia é então removida (DROP PARTITION). As duas operações só mexem nos
+# metadados, o tempo não depende do número de linhas
+# Retorna [(tabela, partição)] retiradas
+def archive_partitions(connection, tables, before, archive=True):
+    before = pd.Timestamp(before)
+    removed = []
+    with connection.cursor() as cursor:
+        for table in tables:
+            for name, bound in table_partitions(connection, table):
+                if(bound is None or bound > before):
+                    continue
+
+                if(archive):
+                    target = "{}__archive_{}".format(table, name)
+                    print("Partition: arquivando {}.{} em {}".format(table, name, target))
+                    execute_ddl(cursor, "CREATE TABLE {} LIKE {}".format(target, table))
+                    execute_ddl(cursor, "ALTER TABLE {} REMOVE PARTITIONING".format(target))
+                    execute_ddl(cursor, "ALTER TABLE {} EXCHANGE PARTITION {} WITH TABLE {}".format(table, name,
+                                                                                                   target))
+                else:
+                    print("Partition: removendo {}.{}".format(table, name))
+                execute_ddl(cursor, "ALTER TABLE {} DROP PARTITION {}".format(table, name))
+                removed.append((table, name))
+    return(removed)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que verifica se a coluna da partição está gravada na tabela (invoice_line particionada)
+# Sem ela, o filtro por período de invoice_line é feito pela junção com invoice
+def carries_partition_column(connection, table):
+    column = partitioned_tables[table]["column"]
+    with connection.cursor(buffered=True) as cursor:
+        try:
+            cursor.execute("SELECT {} FROM {} WHERE 1 = 0".format(column, table))
+            cursor.fetchall()
+            return(True)
+        except Exception:
+            return(False)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que restringe a consulta a um período: cada leitura de uma tabela particionada vira uma tabela
+# derivada com o filtro de data e o mesmo nome (ex.: FROM (SELECT * FROM invoice WHERE ...) AS invoice)
+# O MySQL incorpora a tabela derivada à consulta, então o filtro chega à tabela e só as partições do período
+# são lidas (partition pruning)
+# date_range: (início, fim) com fim exclusivo, um dos dois pode ser None; os valores vão nos parâmetros
+# %(date_from)s e %(date_to)s
+# carried: tabelas que têm a coluna da partição gravada (as outras são filtradas pela tabela de origem)
+def restrict_dates(sql, date_range, carried=()):
+    conditions = []
+    if(date_range[0] is not None):
+        conditions.append("{0} >= %(date_from)s")
+    if(date_range[1] is not None):
+        conditions.append("{0} < %(date_to)s")
+    if(len(conditions) == 0):
+        return(sql)
+
+    def derived(match):
+        table = match.group(2).lower()
+        column = partitioned_tables[table]["column"]
+        if(table in carried or partitioned_tables[table]["source"] is None):
+            select = "SELECT * FROM {} WHERE {}".format(table, " AND ".join(conditions).format(column))
+        else:
+            source_table, key = partitioned_tables[table]["source"]
+            select = "SELECT {0}.* FROM {0} INNER JOIN {1} ON {1}.{2} = {0}.{2} WHERE {3}".format(
+                table, source_table, key, " AND ".join(conditions).format(source_table + "." + column))
+        return("{} ({}) AS {}".format(match.group(1), select, table))
+
+    pattern = r"\b(FROM|JOIN)\s+({})\b(?!\s*\.)".format("|".join(partitioned_tables))
+    return(re.sub(pattern, derived, sql, flags=re.IGNORECASE))
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,370 @@
+# ---------------------------------------------------------------------------------------------------------------------
+# Registro das consultas que respondem as questões propostas no GitHub (ver readme.md)
+# Glenda Proença Train
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que cria o formatador de uma resposta feita com valores da primeira linha do resultado
+# (um período sem vendas não tem linhas)
+def first_row(template, *columns):
+    return(lambda rows: [template.format(*[rows[0][column] for column in columns])] if len(rows) > 0
+           else ["Sem resultados."])
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que cria o formatador de uma resposta feita com as primeiras linhas do resultado
+def top_rows(header, count=10, more=True):
+    return(lambda rows: [header] + ["   {}".format(row) for row in rows[:count]] + (["   ..."] if more else []))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Define as consultas, na ordem do readme.md
+# Cada consulta tem o título da questão, o SQL (com parâmetros no formato %(nome)s), os parâmetros padrão,
+# as tabelas lidas e o formatador que transforma as linhas do resultado nas linhas da resposta
+# "preview" indica quantas linhas a resposta mostra, quando ela não usa o resultado inteiro
+# "summary" é a mesma consulta sobre as tabelas de resumo (materialize.py), usada quando elas estão atualizadas
+# O SQL usa textos entre aspas simples e agrupa por todas as colunas não agregadas, para rodar também nos
+# bancos embarcados (backends.py traduz o que ainda muda entre os dialetos, como o CONCAT no SQLite)
+queries = {
+    # Qual é o gênero musical mais popular?
+    "popular_genre": {
+        "title": "1) Qual é o gênero musical mais popular?",
+        "sql": "SELECT COUNT(track.genre_id) AS popularity, genre.genre_name \
+                FROM track \
+                JOIN genre ON track.genre_id = genre.genre_id \
+                GROUP BY genre.genre_name \
+                ORDER BY popularity DESC LIMIT 1",
+        "params": None,
+        "tables": ["track", "genre"],
+        "format": first_row("   R: {}", 1)
+    },
+
+    # Qual é o artista mais popular?
+    "popular_artist": {
+        "title": "2) Qual é o artista mais popular?",
+        "sql": "SELECT COUNT(invoice_line.quantity) AS purchases, artist.artist_name AS artist_name \
+                FROM invoice_line \
+                INNER JOIN track ON track.track_id = invoice_line.track_id \
+                INNER JOIN album ON track.album_id = album.album_id \
+                INNER JOIN artist ON artist.artist_id = album.artist_id \
+                GROUP BY artist_name \
+                ORDER BY purchases DESC \
+                LIMIT 1",
+        "params": None,
+        "tables": ["invoice_line", "track", "album", "artist"],
+        "summary": {
+            "tables": ["sales_by_customer_artist"],
+            "sql": "SELECT SUM(purchases) AS purchases, artist_name \
+                            FROM sales_by_customer_artist \
+                            GROUP BY artist_name \
+                            ORDER BY purchases DESC \
+                            LIMIT 1"
+        },
+        "format": first_row("   R: {}", 1)
+    },
+
+    # Qual é a música mais popular?
+    "popular_track": {
+        "title": "3) Qual é a música mais popular?",
+        "sql": "SELECT COUNT(invoice_line.quantity) AS purchases, track.track_name AS track_name \
+                FROM invoice_line \
+                INNER JOIN track ON track.track_id = invoice_line.track_id \
+                GROUP BY track_name \
+                ORDER BY purchases DESC \
+                LIMIT 1",
+        "params": None,
+        "tables": ["invoice_line", "track"],
+        "summary": {
+            "tables": ["sales_by_track"],
+            "sql": "SELECT SUM(purchases) AS purchases, track_name \
+                            FROM sales_by_track \
+                            GROUP BY track_name \
+                            ORDER BY purchases DESC \
+                            LIMIT 1"
+        },
+        "format": first_row("   R: {}", 1)
+    },
+
+    # Qual é o preço médio de diferentes tipo de música?
+    "genre_average_price": {
+        "title": "4) Qual é o preço médio de diferentes tipo de música?",
+        "sql": "WITH purchases AS \
+                    (SELECT SUM(invoice.total) AS total_spent, genre.genre_name AS genre \
+                    FROM invoice \
+                    INNER JOIN invoice_line ON invoice_line.invoice_id = invoice.invoice_id \
+                    INNER JOIN track ON track.track_id = invoice_line.track_id \
+                    INNER JOIN genre ON genre.genre_id = track.genre_id \
+                    GROUP BY genre.genre_name \
+                    ORDER BY total_spent) \
+                SELECT genre, CONCAT('$', ROUND(AVG(total_spent))) AS total \
+                FROM purchases \
+                GROUP BY genre",
+        "params": None,
+        "tables": ["invoice", "invoice_line", "track", "genre"],
+        "summary": {
+            "tables": ["sales_by_genre_country"],
+            "sql": "SELECT genre_name AS genre, CONCAT('$', ROUND(SUM(invoice_total))) AS total \
+                            FROM sales_by_genre_country \
+                            GROUP BY genre_name"
+        },
+        "format": lambda rows: ["    {}: {}".format(row[0], row[1]) for row in rows]
+    },
+
+    # Qual é o país mais popular em compras de música?
+    "popular_country": {
+        "title": "5) Qual é o país mais popular em compras de música?",
+        "sql": "SELECT SUM(invoice_line.quantity) AS invoice_quantity, customer.country AS country \
+                FROM invoice_line \
+                INNER JOIN invoice ON invoice.invoice_id = invoice_line.invoice_line_id \
+                INNER JOIN customer ON customer.customer_id = invoice.customer_id \
+                GROUP BY country \
+                ORDER BY invoice_quantity DESC \
+                LIMIT 1",
+        "params": None,
+        "tables": ["invoice_line", "invoice", "customer"],
+        "format": first_row("   R: {}", 1)
+    },
+
+    # Quem é o funcionário mais antigo?
+    "oldest_employee": {
+        "title": "6) Quem é o funcionário mais antigo?",
+        "sql": "SELECT first_name, last_name FROM employee \
+                ORDER BY hire_date ASC \
+                LIMIT 1",
+        "params": None,
+        "tables": ["employee"],
+        "format": first_row("   R: {} {}", 0, 1)
+    },
+
+    # Qual país tem a maior quantidade de faturas?
+    "country_most_invoices": {
+        "title": "7) Qual país tem a maior quantidade de faturas?",
+        "sql": "SELECT COUNT(invoice_id) as invoice_quantity, billing_country \
+                FROM invoice \
+                GROUP BY billing_country \
+                ORDER BY invoice_quantity DESC",
+        "params": None,
+        "tables": ["invoice"],
+        "summary": {
+            "tables": ["sales_by_customer_country"],
+            "sql": "SELECT SUM(invoice_count) AS invoice_quantity, billing_country \
+                            FROM sales_by_customer_country \
+                            GROUP BY billing_country \
+                            ORDER BY invoice_quantity DESC"
+        },
+        "format": first_row("   R: {}", 1)
+    },
+
+    # Qual é o top 3 em valores da fatura total?
+    "top_invoices": {
+        "title": "8) Qual é o top 3 em valores da fatura total?",
+        "sql": "SELECT * FROM invoice \
+                ORDER BY total DESC \
+                LIMIT %(limit)s",
+        "params": {"limit": 3},
+        "tables": ["invoice"],
+        "format": top_rows("   R:", 3, more=False)
+    },
+
+    # Qual cidade tem os melhores clientes?
+    # Nós gostaríamos de dar um festival promocional na cidade em que conseguimos mais dinheiro.
+    # Escreva uma consulta que retorne uma cidade que tenha a maior soma de totais de faturas.
+    # Retorne o nome da cidade e a soma de todos os totais da fatura.
+    "best_city": {
+        "title": "9) Qual cidade tem os melhores clientes?",
+        "sql": "SELECT billing_city, CONCAT('$', ROUND(SUM(total), 2)) AS invoice_total \
+                FROM invoice \
+                GROUP BY billing_city \
+                ORDER BY SUM(total) DESC \
+                LIMIT 1",
+        "params": None,
+        "tables": ["invoice"],
+        "summary": {
+            "tables": ["sales_by_city"],
+            "sql": "SELECT billing_city, CONCAT('$', ROUND(total, 2)) AS invoice_total \
+                            FROM sales_by_city \
+                            ORDER BY total DESC \
+                            LIMIT 1"
+        },
+        "format": first_row("   R: {} com um total de faturas de {}", 0, 1)
+    },
+
+    # Quem é o melhor cliente? O cliente que gastou mais dinheiro será declarado o melhor cliente.
+    # Escreva uma consulta que retorne a pessoa que gastou mais dinheiro.
+    "best_customer": {
+        "title": "10)  Quem é o melhor cliente?",
+        "sql": "SELECT CONCAT('$', ROUND(SUM(invoice.total), 2)) AS invoice_total, customer.first_name, customer.last_name \
+                FROM invoice \
+                INNER JOIN customer ON customer.customer_id = invoice.customer_id \
+                GROUP BY customer.customer_id, customer.first_name, customer.last_name \
+                ORDER BY SUM(invoice.total) DESC",
+        "params": None,
+        "tables": ["invoice", "customer"],
+        "summary": {
+            "tables": ["sales_by_customer_country"],
+            "sql": "SELECT CONCAT('$', ROUND(SUM(total), 2)) AS invoice_total, first_name, last_name \
+                            FROM sales_by_customer_country \
+                            GROUP BY customer_id, first_name, last_name \
+                            ORDER BY SUM(total) DESC"
+        },
+        "format": first_row("   R: {} {} com um total de faturas de {}", 1, 2, 0)
+    },
+
+    # Escreva uma consulta para retornar o e-mail, nome, sobrenome e gênero de todos os ouvintes de rock.
+    # Devolva sua lista ordenada em ordem alfabética por e-mail começando com A.
+    "rock_listeners": {
+        "title": "11) Quais são os emails ordenados dos ouvintes de rock?",
+        "sql": "SELECT DISTINCT customer.first_name, customer.last_name, customer.email, genre.genre_name \
+                FROM customer \
+                INNER JOIN invoice ON invoice.customer_id = customer.customer_id \
+                INNER JOIN invoice_line ON invoice_line.invoice_id = invoice.invoice_id \
+                INNER JOIN track ON track.track_id = invoice_line.track_id \
+                INNER JOIN genre ON genre.genre_id = track.genre_id \
+                WHERE genre.genre_name = %(genre)s \
+                ORDER BY customer.email ASC",
+        "params": {"genre": "Rock"},
+        "tables": ["customer", "invoice", "invoice_line", "track", "genre"],
+        "format": top_rows("   R:"),
+        "preview": 10
+    },
+
+    # Vamos convidar os artistas que mais escreveram rock em nosso conjunto de dados.
+    # Escreva uma consulta que retorne o nome do artista e a contagem total de faixas das 10 principais bandas de rock.
+    "top_rock_bands": {
+        "title": "12) Quais as 10 principais bandas de rock?",
+        "sql": "SELECT COUNT(track.track_id) AS num_songs, artist.artist_name \
+                FROM track \
+                INNER JOIN album ON album.album_id = track.album_id \
+                INNER JOIN artist ON artist.artist_id = album.artist_id \
+                WHERE genre_id \
+                    IN (SELECT genre.genre_id FROM genre \
+                    WHERE genre.genre_name = %(genre)s) \
+                GROUP BY artist.artist_id, artist.artist_name \
+                ORDER BY num_songs DESC \
+                LIMIT %(limit)s",
+        "params": {"genre": "Rock", "limit": 10},
+        "tables": ["track", "album", "artist", "genre"],
+        "format": top_rows("   R: (Número de Músicas x Bandas)")
+    },
+
+    # Retorna todos os nomes de faixas que possuem uma duração de música maior que a duração média da música.
+    # Retorna o nome e os milissegundos de cada faixa. Ordene pela duração da música com as músicas mais longas
+    # listadas primeiro.
+    "long_tracks": {
+        "title": "13) Quais são as faixas que tem duração maior do que média?",
+        "sql": "SELECT track.track_name, track.milliseconds FROM track \
+                WHERE track.milliseconds > \
+                    (SELECT AVG(milliseconds) FROM track) \
+                ORDER BY track.milliseconds DESC",
+        "params": None,
+        "tables": ["track"],
+        "format": top_rows("   R: (Música x Duração(ms))"),
+        "preview": 10
+    },
+
+    # Descubra quanto valor gasto por cada cliente com artistas.
+    # Escreva uma consulta para retornar o nome do cliente, o nome do artista e o total gasto.
+    "customer_artist_spent": {
+        "title": "14) Quanto cada cliente gastou com cada artista?",
+        "sql": "WITH artists_name AS \
+                    (SELECT artist.artist_id AS artist_id, \
+                    artist.artist_name AS artist_name \
+                    FROM invoice_line \
+                    JOIN track ON track.track_id = invoice_line.track_id \
+                    JOIN album ON album.album_id = track.album_id \
+                    JOIN artist ON artist.artist_id = album.artist_id \
+                    GROUP BY artist.artist_id, artist.artist_name) \
+                SELECT customer.customer_id AS customer_id, \
+                customer.first_name AS first_name, \
+                artists_name.artist_name AS artist_name, \
+                SUM(invoice_line.unit_price * invoice_line.quantity) AS total_spent \
+                FROM invoice \
+                JOIN customer ON customer.customer_id = invoice.customer_id \
+                JOIN invoice_line ON invoice_line.invoice_id = invoice.invoice_id \
+                JOIN track ON track.track_id = invoice_line.track_id \
+                JOIN album ON album.album_id = track.album_id \
+                JOIN artists_name ON artists_name.artist_id = album.artist_id \
+                GROUP BY 1, 2, 3 \
+                ORDER BY 4 DESC",
+        "params": None,
+        "tables": ["invoice", "customer", "invoice_line", "track", "album", "artist"],
+        "summary": {
+            "tables": ["sales_by_customer_artist"],
+            "sql": "SELECT customer_id, first_name, artist_name, SUM(total_spent) AS total_spent \
+                            FROM sales_by_customer_artist \
+                            GROUP BY customer_id, first_name, artist_name \
+                            ORDER BY 4 DESC"
+        },
+        "format": top_rows("   R: (Id x Primeiro Nome Cliente X Nome do Artist x Total de Gastos)"),
+        "preview": 10
+    },
+
+    # Queremos descobrir o gênero musical mais popular de cada país.
+    # Determinamos o gênero mais popular como o gênero com maior quantidade de compras.
+    # Escreva uma consulta que retorne cada país junto com o gênero principal.
+    # Para países onde o número máximo de compras é compartilhado, devolva todos os gêneros.
+    "country_popular_genre": {
+        "title": "15) Qual o gênero musical mais popular em cada país?",
+        "sql": "WITH popular_genre AS \
+                    (SELECT COUNT(invoice_line.quantity) AS purchases, \
+                        customer.country, genre.genre_name AS genre_name, \
+                        ROW_NUMBER() OVER(PARTITION BY customer.country \
+                    ORDER BY COUNT(invoice_line.quantity) DESC) AS row_num \
+                    FROM invoice_line \
+                    INNER JOIN invoice ON invoice.invoice_id = invoice_line.invoice_id \
+                    INNER JOIN customer ON customer.customer_id = invoice.customer_id \
+                    INNER JOIN track ON track.track_id = invoice_line.track_id \
+                    INNER JOIN genre ON genre.genre_id = track.genre_id \
+                    GROUP BY 2, 3 \
+                    ORDER BY 2 ASC, 1 DESC) \
+                SELECT country, genre_name, purchases \
+                FROM popular_genre \
+                WHERE row_num <= 1",
+        "params": None,
+        "tables": ["invoice_line", "invoice", "customer", "track", "genre"],
+        "summary": {
+            "tables": ["sales_by_genre_country"],
+            "sql": "WITH popular_genre AS \
+                                (SELECT SUM(purchases) AS purchases, country, genre_name, \
+                                ROW_NUMBER() OVER(PARTITION BY country ORDER BY SUM(purchases) DESC) AS row_num \
+                                FROM sales_by_genre_country \
+                                GROUP BY country, genre_name) \
+                            SELECT country, genre_name, purchases \
+                            FROM popular_genre \
+                            WHERE row_num <= 1"
+        },
+        "format": top_rows("   R: (País x Gênero X Vendas)"),
+        "preview": 10
+    },
+
+    # Escreva uma consulta que determine o cliente que gastou mais em música em cada país.
+    # Escreva uma consulta que retorne o país junto com o principal cliente e quanto ele gastou.
+    # Para países onde o valor mais gasto é compartilhado, forneça todos os clientes que gastaram esse valor.
+    "country_best_customer": {
+        "title": "16) Qual cliente gastou mais em cada país?",
+        "sql": "WITH total_customer_country AS (SELECT customer.first_name, \
+                billing_country, \
+                SUM(invoice.total) AS total_spent, \
+                ROW_NUMBER() OVER(PARTITION BY billing_country ORDER BY SUM(total) DESC) AS row_num \
+                FROM customer \
+                INNER JOIN invoice ON invoice.customer_id = customer.customer_id \
+                GROUP BY 1, 2 \
+                ORDER BY 2, total_spent DESC) \
+                SELECT first_name, billing_country, total_spent \
+                FROM total_customer_country \
+                WHERE row_num = 1",
+        "params": None,
+        "tables": ["customer", "invoice"],
+        "summary": {
+            "tables": ["sales_by_customer_country"],
+            "sql": "WITH total_customer_country AS \
+                                (SELECT first_name, billing_country, SUM(total) AS total_spent, \
+                                ROW_NUMBER() OVER(PARTITION BY billing_country ORDER BY SUM(total) DESC) AS row_num \
+                                FROM sales_by_customer_country \
+                                GROUP BY first_name, billing_country) \
+                            SELECT first_name, billing_country, total_spent \
+                            FROM total_customer_country \
+                            WHERE row_num = 1"
+        },
+        "format": top_rows("   R: (Nome Cliente x País X Total de Gastos)"),
+        "preview": 10
+    }
+}
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,196 @@
+# ---------------------------------------------------------------------------------------------------------------------
+# Execução concorrente das consultas do registro, com medição de cada consulta
+# Glenda Proença Train
+# ---------------------------------------------------------------------------------------------------------------------
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from queries import queries
+from manifest import read_manifest
+from cache import cache_key
+from materialize import fresh_summaries
+from metrics import span
+from partitions import partitioned_tables, carries_partition_column, restrict_dates
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que estima o volume (bytes) dos valores retornados por uma consulta
+def result_bytes(rows):
+    return(sum(len(str(value).encode("utf-8")) for row in rows for value in row if value is not None))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que junta os parâmetros padrão da consulta com os informados
+# (apenas os parâmetros que a consulta usa são substituídos)
+def query_params(query, params=None):
+    if(query["params"] is None):
+        return(None)
+    return({name: (params or {}).get(name, value) for name, value in query["params"].items()})
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que limita o número de linhas da consulta no próprio SQL (se ela ainda não tiver LIMIT)
+def limit_sql(sql, limit):
+    sql = sql.rstrip().rstrip(";")
+    if(re.search(r"\bLIMIT\s+\S+$", sql, re.IGNORECASE) is not None):
+        return(sql)
+    return("{} LIMIT {}".format(sql, int(limit)))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que lê o resultado de uma consulta aos poucos (gerador de linhas)
+# O cursor sem buffer recebe as linhas do servidor conforme são lidas, em lotes do fetchmany,
+# então a memória não cresce com o tamanho do resultado
+def stream_query(connection, sql, params=None, batch_size=1000):
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        while(True):
+            rows = cursor.fetchmany(batch_size)
+            if(len(rows) == 0):
+                break
+            for row in rows:
+                yield(row)
+    finally:
+        # Se a leitura for interrompida, descarta o resto do resultado para liberar a conexão
+        if(connection.unread_result):
+            connection.consume_results()
+        cursor.close()
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Modos de leitura do resultado das consultas
+# buffered: lê o resultado inteiro (fetchall)
+# stream: lê em lotes e guarda só as linhas que a resposta mostra
+# preview: além do stream, limita o SQL às linhas que a resposta mostra
+fetch_modes = ["buffered", "stream", "preview"]
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que lê a versão atual de cada tabela (hash do csv carregado, registrado no manifesto da carga)
+def table_versions(pool):
+    connection = pool.get_connection()
+    try:
+        return({table: digest for table, (digest, rows) in read_manifest(connection).items()})
+    finally:
+        connection.close()
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que descobre as tabelas de resumo atualizadas (que podem substituir as consultas originais)
+def current_summaries(pool):
+    connection = pool.get_connection()
+    try:
+        return(fresh_summaries(connection))
+    finally:
+        connection.close()
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que executa uma consulta do registro em uma conexão do pool
+# Se as tabelas de resumo usadas pela consulta estiverem atualizadas, a consulta lê os resumos
+# Com o cache, a resposta é reaproveitada enquanto as tabelas lidas pela consulta estiverem na mesma versão
+# Retorna as linhas e as medidas da consulta (latência, linhas e bytes retornados)
+def run_query(pool, name, params=None, fetch="preview", batch_size=1000, cache=None, versions=None, fresh=(),
+              date_range=None, carried=()):
+    query = queries[name]
+    sql = query["sql"]
+    summary = query.get("summary") is not None and set(query["summary"]["tables"]) <= set(fresh)
+    if(summary):
+        sql = query["summary"]["sql"]
+    params = query_params(query, params)
+
+    # Período informado: as tabelas particionadas são filtradas pela data (os resumos não têm a data)
+    if(date_range is not None):
+        sql = restrict_dates(sql, date_range, carried)
+        if(sql != query["sql"]):
+            params = dict(params or {}, date_from=date_range[0], date_to=date_range[1])
+
+    keep = query.get("preview")
+    if(fetch == "preview" and keep is not None):
+        sql = limit_sql(sql, keep)
+
+    # Só usa o cache se todas as tabelas lidas tiverem versão conhecida
+    key = None
+    if(cache is not None and versions is not None and all(versions.get(table) for table in query["tables"])):
+        key = cache_key(sql, [fetch, params], {table: versions[table] for table in query["tables"]})
+        start = time.perf_counter()
+        cached = cache.get(key)
+        if(cached is not None):
+            return(dict(cached, name=name, latency=time.perf_counter() - start, cached=True, summary=summary))
+
+    connection = pool.get_connection()
+    try:
+        start = time.perf_counter()
+        if(fetch == "buffered"):
+            with connection.cursor(buffered=True) as cursor:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+            row_count = len(rows)
+            size = result_bytes(rows)
+        else:
+            rows = []
+            row_count = 0
+            size = 0
+            for row in stream_query(connection, sql, params, batch_size):
+                row_count += 1
+                size += result_bytes([row])
+                if(keep is None or len(rows) < keep):
+                    rows.append(row)
+        latency = time.perf_counter() - start
+    finally:
+        # Devolve a conexão para o pool
+        connection.close()
+
+    if(key is not None):
+        cache.put(key, query["tables"], {"rows": rows, "row_count": row_count, "bytes": size})
+
+    return({"name": name,
+            "rows": rows,
+            "latency": latency,
+            "row_count": row_count,
+            "bytes": size,
+            "cached": False,
+            "summary": summary})
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que descobre as tabelas particionadas que têm a coluna da partição gravada
+def partition_columns(pool):
+    connection = pool.get_connection()
+    try:
+        return({table for table in partitioned_tables if carries_partition_column(connection, table)})
+    finally:
+        connection.close()
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que executa a consulta registrando um span com as linhas e os bytes retornados
+def measured_query(pool, name, params=None, fetch="preview", cache=None, versions=None, fresh=(), date_range=None,
+                   carried=()):
+    with span("query", name) as record:
+        result = run_query(pool, name, params, fetch, cache=cache, versions=versions, fresh=fresh,
+                           date_range=date_range, carried=carried)
+        record.update(rows=result["row_count"], bytes=result["bytes"], cached=result["cached"],
+                      summary=result["summary"])
+    return(result)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que executa as consultas escolhidas (todas, se nenhuma for informada) em paralelo
+# Com date_range (início, fim exclusivo), as consultas só leem as notas e os itens do período
+# Retorna os resultados na ordem do registro
+def run_queries(pool, names=None, workers=4, params=None, fetch="preview", cache=None, summaries=True,
+                date_range=None):
+    names = [name for name in queries if names is None or name in names]
+    versions = table_versions(pool) if cache is not None else None
+    fresh = current_summaries(pool) if summaries and date_range is None else set()
+    carried = partition_columns(pool) if date_range is not None else set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return(list(executor.map(lambda name: measured_query(pool, name, params, fetch, cache, versions, fresh,
+                                                             date_range, carried),
+                                 names)))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que imprime as medidas de cada consulta e o tempo total da execução em paralelo
+def print_query_report(results, wall):
+    print("\nConsultas:")
+    print("   {:<24} {:>12} {:>10} {:>12} {:>6} {:>7}".format("Consulta", "Tempo(ms)", "Linhas", "Bytes", "Cache",
+                                                              "Resumo"))
+    for result in results:
+        print("   {:<24} {:>12.3f} {:>10} {:>12} {:>6} {:>7}".format(result["name"], result["latency"] * 1000,
+                                                                    result["row_count"], result["bytes"],
+                                                                    "sim" if result["cached"] else "não",
+                                                                    "sim" if result["summary"] else "não"))
+    print("   Tempo total: {:.2f} ms (soma das consultas: {:.2f} ms)".format(wall * 1000,
+                                                                         sum(r["latency"] for r in results) * 1000))
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,70 @@
+# ---------------------------------------------------------------------------------------------------------------------
+# Escalonador da carga: respeita a ordem das chaves estrangeiras e carrega tabelas independentes em paralelo
+# Glenda Proença Train
+# ---------------------------------------------------------------------------------------------------------------------
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from schema import split_reference
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que monta o grafo de dependências (DAG) a partir das chaves estrangeiras
+# Retorna {tabela: conjunto de tabelas que precisam ser carregadas antes}
+# Auto-relacionamentos (ex.: employee.reports_to) não geram dependência
+def table_dependencies(relationships):
+    dependencies = {}
+    for table in relationships:
+        dependencies[table] = set()
+        for f_key in relationships[table]["f_key"] or []:
+            parent = split_reference(f_key[1])[0]
+            if(parent != table):
+                dependencies[table].add(parent)
+    return(dependencies)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que agrupa as tabelas em níveis: cada nível depende apenas dos níveis anteriores
+# Ex.: [[artist, genre, media_type, playlist, employee], [album, customer], ...]
+def dependency_levels(dependencies):
+    levels = []
+    done = set()
+    pending = set(dependencies)
+    while(len(pending) > 0):
+        level = sorted(table for table in pending if dependencies[table] <= done)
+        if(len(level) == 0):
+            raise ValueError("Dependência circular entre as tabelas: {}".format(sorted(pending)))
+        levels.append(level)
+        done.update(level)
+        pending.difference_update(level)
+    return(levels)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que executa uma tarefa por tabela em paralelo, respeitando as dependências
+# Uma tabela é iniciada assim que todas as suas dependências terminam (sem esperar o nível inteiro)
+# Retorna os resultados das tarefas na ordem em que terminaram
+def run_in_order(tables, dependencies, task, workers=4):
+    # Dependências de tabelas que não fazem parte da carga são ignoradas
+    pending = {table: dependencies.get(table, set()) & set(tables) for table in tables}
+    dependency_levels(pending)
+
+    results = []
+    done = set()
+    running = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while(len(pending) > 0 or len(running) > 0):
+
+            # Inicia todas as tabelas que já estão liberadas
+            for table in [table for table in pending if pending[table] <= done]:
+                running[executor.submit(task, table)] = table
+                del pending[table]
+
+            # Aguarda a próxima tabela terminar (um erro cancela o que ainda não começou)
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                table = running.pop(future)
+                try:
+                    results.append(future.result())
+                except Exception:
+                    for other in running:
+                        other.cancel()
+                    raise
+                done.add(table)
+    return(results)
+# ---------------------------------------------------------------------------------------------------------------------
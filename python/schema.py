@@ -0,0 +1,140 @@
+# ---------------------------------------------------------------------------------------------------------------------
+# Geração do DDL (CREATE TABLE) a partir do mapa de relações e dos tipos do csv
+# Glenda Proença Train
+# ---------------------------------------------------------------------------------------------------------------------
+import pandas as pd
+from metrics import execute_ddl
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que separa a referência "tabela(coluna)" de uma chave estrangeira
+def split_reference(reference):
+    table, column = reference.rstrip(")").split("(")
+    return(table, column)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que retorna todas as colunas que são chaves (primária ou estrangeira) de uma tabela
+def key_columns(table, relationships):
+    keys = set()
+    if(relationships[table]["p_key"] is not None):
+        keys.add(relationships[table]["p_key"])
+    for f_key in relationships[table]["f_key"] or []:
+        keys.add(f_key[0])
+    return(keys)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que define o tipo MySQL de uma coluna a partir dos dados do csv
+def infer_column_type(series):
+    values = series.dropna()
+
+    if(pd.api.types.is_datetime64_any_dtype(series)):
+        return("DATETIME")
+    if(pd.api.types.is_bool_dtype(series)):
+        return("BOOLEAN")
+
+    # Inteiros (colunas float só com valores inteiros são inteiros com NULL)
+    if(len(values) > 0 and pd.api.types.is_numeric_dtype(series)):
+        if(pd.api.types.is_integer_dtype(series) or (values % 1 == 0).all()):
+            if(values.min() >= -2**31 and values.max() < 2**31):
+                return("INT")
+            return("BIGINT")
+        return("DOUBLE")
+
+    # Textos: tamanho com folga (potência de 2 acima do dobro do maior valor) para as próximas cargas
+    length = int(values.astype(str).str.len().max()) if len(values) > 0 else 0
+    size = 32
+    while(size < 2 * length):
+        size *= 2
+    if(size > 1024):
+        return("TEXT")
+    return("VARCHAR({})".format(size))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que monta o CREATE TABLE completo (colunas tipadas, chave primária e chaves estrangeiras)
+# O sufixo cria uma cópia auxiliar da tabela (ex.: track__staging), referenciando as cópias com o mesmo sufixo
+# partition: [coluna, cláusula PARTITION BY] da tabela particionada (ver partitions.py); a coluna entra na chave
+# primária e as chaves estrangeiras não são declaradas (o MySQL não as aceita em tabelas particionadas)
+def create_table_sql(table, df, relationships, suffix="", partition=None):
+    p_key = relationships[table]["p_key"]
+    keys = key_columns(table, relationships)
+    primary = [p_key] if partition is None else [p_key, partition[0]]
+
+    definitions = []
+    for column in df.columns:
+        # As chaves são sempre do tipo int
+        column_type = "INT" if column in keys else infer_column_type(df[column])
+        if(column in primary):
+            column_type += " NOT NULL"
+        definitions.append("{} {}".format(column, column_type))
+
+    if(p_key is not None):
+        definitions.append("PRIMARY KEY ({})".format(", ".join(primary)))
+    for f_key in relationships[table]["f_key"] if partition is None and relationships[table]["f_key"] else []:
+        ref_table, ref_column = split_reference(f_key[1])
+        definitions.append("FOREIGN KEY ({}) REFERENCES {}{}({})".format(f_key[0], ref_table, suffix, ref_column))
+
+    sql = "CREATE TABLE {}{} (\n    {}\n) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4".format(table, suffix,
+                                                                                   ",\n    ".join(definitions))
+    if(partition is not None):
+        sql += "\n" + partition[1]
+    return(sql)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que cria a tabela já com o tipo das colunas e as relações definidas
+def create_table(connection, table, df, relationships, suffix="", partition=None):
+    with connection.cursor() as cursor:
+        execute_ddl(cursor, create_table_sql(table, df, relationships, suffix, partition))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que liga ou desliga a verificação das chaves estrangeiras na sessão
+# (desligada durante a carga em massa, para as tabelas poderem ser carregadas em qualquer ordem)
+def set_foreign_key_checks(connection, enabled):
+    with connection.cursor() as cursor:
+        cursor.execute("SET foreign_key_checks = {}".format(1 if enabled else 0))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que religa as chaves estrangeiras e valida os dados carregados
+# (o MySQL não revalida as linhas já inseridas ao religar o foreign_key_checks)
+# Se as tabelas alteradas forem informadas, valida apenas as relações que envolvem essas tabelas
+# Retorna a lista de chaves estrangeiras com linhas órfãs
+def validate_relationships(connection, relationships, tables=None, suffix=""):
+    set_foreign_key_checks(connection, True)
+
+    invalid = []
+    with connection.cursor(buffered=True) as cursor:
+        for table in relationships:
+            for f_key in relationships[table]["f_key"] or []:
+                ref_table, ref_column = split_reference(f_key[1])
+                if(tables is not None and table not in tables and ref_table not in tables):
+                    continue
+                print("F_key: validando a chave estrangeira {}.{}".format(table, f_key[0]))
+
+                cursor.execute("SELECT COUNT(*) FROM {0} AS child \
+                                LEFT JOIN {1} AS parent ON parent.{2} = child.{3} \
+                                WHERE child.{3} IS NOT NULL AND parent.{2} IS NULL".format(table + suffix,
+                                                                                          ref_table + suffix,
+                                                                                          ref_column, f_key[0]))
+                orphans = cursor.fetchone()[0]
+                if(orphans > 0):
+                    print("Erro: {} linhas de {} sem correspondência em {}".format(orphans, table, f_key[1]))
+                    invalid.append((table, f_key[0], orphans))
+    return(invalid)
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que exclui as tabelas informadas (as que existirem)
+# As chaves estrangeiras das tabelas são descobertas pelo information_schema e removidas antes do DROP
+def drop_tables(connection, tables):
+    if(len(tables) == 0):
+        return
+
+    with connection.cursor(buffered=True) as cursor:
+        cursor.execute("SELECT DISTINCT TABLE_NAME, CONSTRAINT_NAME \
+                        FROM information_schema.KEY_COLUMN_USAGE \
+                        WHERE TABLE_SCHEMA = DATABASE() \
+                        AND REFERENCED_TABLE_NAME IS NOT NULL \
+                        AND TABLE_NAME IN ({})".format(", ".join(["%s"] * len(tables))), tuple(tables))
+
+        for table, constraint in cursor.fetchall():
+            execute_ddl(cursor, "ALTER TABLE {} DROP FOREIGN KEY {}".format(table, constraint))
+
+        execute_ddl(cursor, "DROP TABLE IF EXISTS {}".format(", ".join(tables)))
+# ---------------------------------------------------------------------------------------------------------------------
@@ -0,0 +1,50 @@
+# ---------------------------------------------------------------------------------------------------------------------
+# Recarga sem indisponibilidade: carga em tabelas de staging e troca atômica com RENAME TABLE
+# Glenda Proença Train
+# ---------------------------------------------------------------------------------------------------------------------
+from schema import drop_tables
+from metrics import execute_ddl
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Sufixos das cópias auxiliares de cada tabela
+staging_suffix = "__staging"
+old_suffix = "__old"
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que troca as tabelas de staging pelas tabelas em uso em um único RENAME TABLE (atômico)
+# As tabelas em uso viram a cópia __old (a geração __old anterior é descartada), usada no rollback
+# O InnoDB acompanha o RENAME nas chaves estrangeiras: as tabelas de staging passam a se referenciar pelo nome final
+def swap_tables(connection, tables, existing):
+    drop_tables(connection, [table + old_suffix for table in tables if table + old_suffix in existing])
+
+    renames = []
+    for table in tables:
+        if(table in existing):
+            renames.append("{0} TO {0}{1}".format(table, old_suffix))
+    for table in tables:
+        renames.append("{0}{1} TO {0}".format(table, staging_suffix))
+
+    print("Swap: trocando {} tabelas em um único RENAME TABLE".format(len(tables)))
+    with connection.cursor() as cursor:
+        execute_ddl(cursor, "RENAME TABLE {}".format(", ".join(renames)))
+# ---------------------------------------------------------------------------------------------------------------------
+
+# Função que desfaz a última troca, voltando as tabelas __old para uso (também em um único RENAME TABLE)
+# As tabelas que estavam em uso passam a ser a cópia __old, então um novo rollback refaz a troca
+def rollback_tables(connection, tables, existing):
+    tables = [table for table in tables if table in existing and table + old_suffix in existing]
+    if(len(tables) == 0):
+        print("Rollback: não há cópia __old das tabelas")
+        return([])
+
+    renames = []
+    for table in tables:
+        renames.append("{0} TO {0}__swap".format(table))
+        renames.append("{0}{1} TO {0}".format(table, old_suffix))
+        renames.append("{0}__swap TO {0}{1}".format(table, old_suffix))
+
+    print("Rollback: voltando {} tabelas para a versão anterior".format(len(tables)))
+    with connection.cursor() as cursor:
+        execute_ddl(cursor, "RENAME TABLE {}".format(", ".join(renames)))
+    return(tables)
+# ---------------------------------------------------------------------------------------------------------------------